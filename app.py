@@ -3,34 +3,99 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from sqlalchemy.orm import DeclarativeBase
+import sqlite_tuning
 
 
 class Base(DeclarativeBase):
     pass
 
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={"class_": sqlite_tuning.RoutingSession})
 login_manager = LoginManager()
 
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "your-secret-key")
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///quizmaster.db")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_size": 5,
-    "pool_recycle": 300,
-    "pool_pre_ping": True
-}
+# The application is built by create_app(). `from app import app` builds the
+# default one on first use (see __getattr__ below), so the modules that only
+# need db and login_manager (models and the rest) do not pull in the views.
+# Nothing here touches the database: `flask migrate-db` creates and upgrades
+# the schema (see migrations.py).
 
-db.init_app(app)
-login_manager.init_app(app)
-login_manager.login_view = 'auth.login'
 
-from routes import auth_bp, admin_bp, user_bp
+def create_app(config=None):
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SESSION_SECRET", "your-secret-key")
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///quizmaster.db")
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_size": 5,
+        "pool_recycle": 300,
+        "pool_pre_ping": True
+    }
+    app.config["SQLITE_TUNING"] = os.environ.get("SQLITE_TUNING") == "1"
+    app.config["SQLITE_SYNCHRONOUS"] = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+    app.config["SQLITE_BUSY_TIMEOUT"] = int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000))  # milliseconds
+    app.config["SQLITE_MMAP_SIZE"] = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+    app.config["SQLITE_CACHE_SIZE"] = int(os.environ.get("SQLITE_CACHE_SIZE", -64 * 1024))  # negative: KiB
+    app.config["SQLITE_READERS"] = int(os.environ.get("SQLITE_READERS", 4))
+    app.config["QUERY_COUNTER"] = os.environ.get("QUERY_COUNTER") == "1"
+    app.config["METRICS"] = os.environ.get("METRICS") == "1"
+    app.config["METRICS_ALLOCATIONS"] = os.environ.get("METRICS_ALLOCATIONS") == "1"
+    app.config["PROFILE_SLOW_REQUESTS"] = float(os.environ.get("PROFILE_SLOW_REQUESTS", 0))
+    app.config["PROFILE_INTERVAL"] = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+    app.config["PROFILE_DIR"] = os.environ.get("PROFILE_DIR", "profiles")
+    app.config["ATTEMPT_INGEST"] = os.environ.get("ATTEMPT_INGEST", "sync")
+    app.config["ATTEMPT_BATCH_SIZE"] = int(os.environ.get("ATTEMPT_BATCH_SIZE", 200))
+    app.config["ATTEMPT_BATCH_WINDOW"] = float(os.environ.get("ATTEMPT_BATCH_WINDOW", 0.05))
+    app.config["ATTEMPT_QUEUE_SIZE"] = int(os.environ.get("ATTEMPT_QUEUE_SIZE", 10000))
+    app.config["ATTEMPT_JOURNAL_DIR"] = os.environ.get("ATTEMPT_JOURNAL_DIR")
+    app.config["QUIZ_SESSION_STORE"] = os.environ.get("QUIZ_SESSION_STORE", "shared")
+    app.config["QUIZ_SESSION_DIR"] = os.environ.get("QUIZ_SESSION_DIR")
+    app.config["QUIZ_SUBMIT_GRACE"] = int(os.environ.get("QUIZ_SUBMIT_GRACE", 30))
+    app.config["QUIZ_AUTOSAVE_INTERVAL"] = int(os.environ.get("QUIZ_AUTOSAVE_INTERVAL", 10))
+    app.config["QUIZ_SESSION_SWEEP_INTERVAL"] = int(os.environ.get("QUIZ_SESSION_SWEEP_INTERVAL", 60))
+    app.config["QUIZ_SESSION_SWEEP_LIMIT"] = int(os.environ.get("QUIZ_SESSION_SWEEP_LIMIT", 10))
+    app.config["FRAGMENT_CACHE_BYTES"] = int(os.environ.get("FRAGMENT_CACHE_BYTES", 8 * 1024 * 1024))
+    app.config["USER_CACHE_TTL"] = float(os.environ.get("USER_CACHE_TTL", 30))
+    app.config["PASSWORD_HASH_METHOD"] = os.environ.get("PASSWORD_HASH_METHOD", "scrypt")
+    app.config["PASSWORD_HASH_THREADS"] = int(os.environ.get("PASSWORD_HASH_THREADS", os.cpu_count() or 1))
+    app.config["PASSWORD_HASH_QUEUE"] = int(os.environ.get("PASSWORD_HASH_QUEUE", 64))
+    app.config["PASSWORD_HASH_TIMEOUT"] = float(os.environ.get("PASSWORD_HASH_TIMEOUT", 5))
+    app.config.update(config or {})
+    if app.config["SQLITE_TUNING"] and app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+        # A single writer connection per worker; reads get their own pool (see sqlite_tuning.py)
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"pool_size": 1, "max_overflow": 0, "pool_timeout": 30}
 
-app.register_blueprint(auth_bp)
-app.register_blueprint(admin_bp)
-app.register_blueprint(user_bp)
+    db.init_app(app)
+    sqlite_tuning.init_app(app, db)
+    login_manager.init_app(app)
+    login_manager.login_view = 'auth.login'
 
-with app.app_context():
-    db.create_all()
+    # Imported here rather than at the top: they import db from this module
+    import instrumentation
+    instrumentation.init_app(app)
+
+    import user_cache  # noqa: F401  registers the Flask-Login user loader
+
+    import fragments
+    fragments.init_app(app)
+
+    from routes import auth_bp, admin_bp, user_bp
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(user_bp)
+
+    from commands import commands_bp
+    app.register_blueprint(commands_bp)
+
+    import timeseries
+    timeseries.init_app(app)
+
+    return app
+
+
+def __getattr__(name):
+    # The default application, built from the environment on first use
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    global app
+    app = create_app()
+    return app
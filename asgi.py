@@ -0,0 +1,239 @@
+"""ASGI entry point: async student routes in front of the WSGI app.
+
+    uvicorn asgi:application --workers 4
+
+take_quiz, submit_quiz and user_dashboard are served by a Quart app that
+reads through an async SQLAlchemy engine (aiosqlite or asyncpg), so a worker
+keeps serving other students while it waits on the database. Every other
+URL, including static files, is passed through to the Flask app unchanged.
+
+Both apps share the secret key and the signed session cookie, so a student
+logged in through Flask is recognised here, and flashes made here show up
+on Flask pages and the other way around. Quiz sessions (start times and
+autosaved answers, see quiz_sessions.py) are shared with the Flask routes,
+which also serve the autosave endpoint. Graded attempts are handed to the
+ingestion pipeline in ingest.py (use ATTEMPT_INGEST=batched to keep writes
+off the request entirely).
+"""
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, render_template, redirect, url_for, flash, request, session, abort, g, make_response
+from quart.routing import QuartRule
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from werkzeug.exceptions import HTTPException
+from app import app as flask_app, db
+from models import User, QuizAttempt
+from routes import user_chart_data, questions_statement, drawn_order
+import content
+import fragments
+import grading
+import quiz_sessions
+import rollups
+import sqlite_tuning
+import user_cache
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+
+def _async_engine():
+    # Use the URL Flask-SQLAlchemy resolved, so relative SQLite paths point
+    # at the same file
+    with flask_app.app_context():
+        url = db.engine.url
+    engine = create_async_engine(url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()]),
+                                 pool_pre_ping=True)
+    if 'sqlite_reader' in flask_app.extensions:
+        # Only reads go through this engine; writes use the Flask app's
+        sqlite_tuning.configure_reader(engine.sync_engine, flask_app.config)
+    return engine
+
+
+engine = _async_engine()
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+async_app = Quart(__name__, static_folder=None)
+async_app.secret_key = flask_app.secret_key
+async_app.config['SESSION_COOKIE_NAME'] = flask_app.config['SESSION_COOKIE_NAME']
+
+async_app.jinja_env.globals['cached_fragment'] = fragments.cached_fragment
+
+ANONYMOUS = SimpleNamespace(is_authenticated=False, is_admin=False)
+
+
+@async_app.context_processor
+def inject_current_user():
+    return {'current_user': g.get('user', ANONYMOUS)}
+
+
+@async_app.after_serving
+async def dispose_engine():
+    await engine.dispose()
+
+
+async def _load_user(db_session):
+    # The user id Flask-Login stored in the shared session cookie
+    user_id = session.get('_user_id')
+    if user_id is None or not user_id.isdigit():
+        return None
+    user = user_cache.cached(int(user_id))
+    if user is None:
+        row = (await db_session.execute(user_cache.USER_QUERY.where(User.id == int(user_id)))).first()
+        if row is None:
+            return None
+        user = user_cache.remember(row, flask_app.config['USER_CACHE_TTL'])
+    return user
+
+
+async def _login_redirect():
+    await flash('Please log in to access this page.')
+    return redirect(url_for('auth.login', next=request.path))
+
+
+async def _catalog(db_session):
+    version = (await db_session.execute(content.VERSION_QUERY)).scalar() or 0
+    tree = content.cached_tree(version)
+    if tree is None:
+        rows = [(await db_session.execute(stmt)).all() for stmt in content.tree_statements()]
+        tree = content.remember_tree(content.build_tree(version, *rows))
+    return tree
+
+
+async def _answer_key(db_session, quiz_id, version):
+    key = grading.cached_answer_key(quiz_id, version)
+    if key is None:
+        rows = (await db_session.execute(grading.answer_key_statement(quiz_id))).all()
+        key = grading.remember_answer_key(quiz_id, version, grading.build_answer_key(rows))
+    return key
+
+
+async def _in_flask(function, *args):
+    # Quiz sessions and ingestion read Flask's config, and block: on the
+    # session store's file locks and reads, or on the database. They run on
+    # a thread, so a slow disk never stalls the event loop
+    def call():
+        with flask_app.app_context():
+            return function(*args)
+
+    return await asyncio.to_thread(call)
+
+
+@async_app.route('/user/dashboard', endpoint='user.user_dashboard')
+async def user_dashboard():
+    async with Session() as db_session:
+        g.user = await _load_user(db_session)
+        if g.user is None:
+            return await _login_redirect()
+        tree = await _catalog(db_session)
+
+        # Get user's recent attempts
+        attempts = (await db_session.execute(
+            select(QuizAttempt).where(QuizAttempt.user_id == g.user.id)
+            .order_by(QuizAttempt.completed_at.desc())
+            .limit(5)
+        )).scalars().all()
+
+        bar_chart_data, pie_chart_data = user_chart_data(
+            (await db_session.execute(rollups.user_subject_attempts_statement(g.user.id))).all(),
+            (await db_session.execute(rollups.user_monthly_attempts_statement(g.user.id))).all()
+        )
+
+    return await fragments.async_conditional(request, await make_response(await render_template(
+        'user/dashboard.html',
+        subjects=tree.subjects,
+        catalog_version=tree.version,
+        quizzes=tree.quizzes,
+        attempts=attempts,
+        bar_chart_data=bar_chart_data,
+        pie_chart_data=pie_chart_data)))
+
+
+@async_app.route('/user/quiz/<int:quiz_id>', endpoint='user.take_quiz')
+async def take_quiz(quiz_id):
+    async with Session() as db_session:
+        g.user = await _load_user(db_session)
+        if g.user is None:
+            return await _login_redirect()
+        tree = await _catalog(db_session)
+        quiz = tree.quizzes.get(quiz_id)
+        if quiz is None:
+            abort(404)
+        now = datetime.utcnow()
+        if now < quiz.start_date or now > quiz.end_date:
+            await flash('Quiz is not available at this time')
+            return redirect(url_for('user.user_dashboard'))
+        # The key is only needed to draw questions for a new session
+        key = await _answer_key(db_session, quiz_id, tree.version) if quiz.sample_size is not None else None
+
+        expired = await _in_flask(quiz_sessions.take_expired, g.user.id, quiz.id, now)
+        if expired is not None:
+            await _in_flask(quiz_sessions.record_expired, expired)
+        quiz_session = await _in_flask(quiz_sessions.begin, g.user.id, quiz.id, quiz.duration, now,
+                                        lambda: grading.sample_questions(key, quiz.sample_size) if key else None)
+        questions = drawn_order((await db_session.execute(
+            questions_statement(quiz_id, quiz_session.question_ids)
+        )).scalars().all(), quiz_session.question_ids)
+
+    return await render_template('user/quiz.html',
+                                 quiz=quiz,
+                                 questions=questions,
+                                 answers=quiz_session.answers,
+                                 remaining=quiz_sessions.remaining_seconds(quiz_session, now),
+                                 autosave_interval=flask_app.config['QUIZ_AUTOSAVE_INTERVAL'])
+
+
+@async_app.route('/user/quiz/<int:quiz_id>/submit', methods=['POST'], endpoint='user.submit_quiz')
+async def submit_quiz(quiz_id):
+    async with Session() as db_session:
+        g.user = await _load_user(db_session)
+        if g.user is None:
+            return await _login_redirect()
+        now = datetime.utcnow()
+        quiz_session, on_time = await _in_flask(quiz_sessions.finish, g.user.id, quiz_id, now)
+        if quiz_session is None:
+            await flash('This quiz is not in progress. Start it from your dashboard.')
+            return redirect(url_for('user.user_dashboard'))
+        tree = await _catalog(db_session)
+        quiz = tree.quizzes.get(quiz_id)
+        if quiz is None:
+            abort(404)
+        key = await _answer_key(db_session, quiz_id, tree.version)
+
+    # Graded and recorded as by the Flask route, with the quiz and key read
+    # here through the async engine
+    form = (await request.form).to_dict()
+    score, question_count = await _in_flask(quiz_sessions.record, quiz_session, on_time, form, now, quiz, key)
+    await flash(quiz_sessions.result_message(score, question_count, on_time))
+    return redirect(url_for('user.user_dashboard'))
+
+
+# Every Flask endpoint the async app does not serve itself is registered
+# build-only, so url_for() in the shared templates resolves as usual
+for rule in flask_app.url_map.iter_rules():
+    if rule.endpoint not in async_app.view_functions:
+        build_rule = QuartRule(rule.rule, endpoint=rule.endpoint, methods=rule.methods)
+        build_rule.build_only = True
+        async_app.url_map.add(build_rule)
+
+_async_routes = async_app.url_map.bind('localhost')
+_wsgi = WsgiToAsgi(flask_app)
+
+
+def _serves(scope):
+    try:
+        _async_routes.match(scope['path'], method=scope['method'])
+    except HTTPException:
+        return False
+    return True
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan' or (scope['type'] == 'http' and _serves(scope)):
+        await async_app(scope, receive, send)
+    else:
+        await _wsgi(scope, receive, send)
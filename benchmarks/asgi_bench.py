@@ -0,0 +1,98 @@
+"""Concurrent students per core: sync WSGI workers vs the ASGI mode.
+
+Starts one single-worker server per mode on a local port, logs in
+--students virtual students (one cookie jar each) and has them loop over
+dashboard -> take quiz -> submit for --duration seconds at each concurrency
+level. One worker is one core, so req/s here is capacity per core.
+
+    python benchmarks/asgi_bench.py --concurrency 10 50 200
+    python benchmarks/asgi_bench.py --database-url postgresql://...
+
+Needs gunicorn, uvicorn and httpx. Without --database-url a throwaway SQLite
+database is used, which serialises writes and so understates both modes.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import common
+
+SERVERS = {
+    'wsgi': lambda port: ['gunicorn', '-w', '1', '-k', 'sync', '-b', f'127.0.0.1:{port}', 'app:app'],
+    'asgi': lambda port: ['uvicorn', 'asgi:application', '--workers', '1', '--port', str(port),
+                          '--log-level', 'warning'],
+}
+
+
+async def student(client, number, quiz_id, answers, stop_at, latencies, errors):
+    await client.post('/login', data={'username': f'student{number}', 'password': common.PASSWORD})
+    while time.monotonic() < stop_at:
+        for method, path, data in (
+            ('GET', '/user/dashboard', None),
+            ('GET', f'/user/quiz/{quiz_id}', None),
+            ('POST', f'/user/quiz/{quiz_id}/submit', answers),
+        ):
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, data=data)
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+            except Exception as e:
+                errors.append(type(e).__name__)
+                continue
+            latencies.append(time.perf_counter() - started)
+
+
+async def load(base_url, concurrency, duration, quiz_id, answers):
+    import httpx
+
+    latencies = []
+    errors = []
+    limits = httpx.Limits(max_connections=1, max_keepalive_connections=1)
+    clients = [httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) for _ in range(concurrency)]
+    stop_at = time.monotonic() + duration
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            student(client, i, quiz_id, answers, stop_at, latencies, errors)
+            for i, client in enumerate(clients)
+        ))
+    finally:
+        await asyncio.gather(*(client.aclose() for client in clients))
+    return len(latencies) / (time.perf_counter() - started), latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 100])
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per level')
+    parser.add_argument('--questions', type=int, default=20)
+    parser.add_argument('--modes', nargs='+', choices=sorted(SERVERS), default=['wsgi', 'asgi'])
+    parser.add_argument('--database-url', help='defaults to a throwaway SQLite database')
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        common.use_scratch_database()
+    quiz_id, question_ids = common.seed_quiz(max(args.concurrency), args.questions)
+    answers = {f'question_{question_id}': 'A' for question_id in question_ids}
+
+    print(f'{"mode":>5} {"users":>6} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"errors":>7}')
+    for mode in args.modes:
+        server, base_url = common.start_server(SERVERS[mode])
+        try:
+            for concurrency in args.concurrency:
+                rate, latencies, errors = asyncio.run(load(base_url, concurrency, args.duration,
+                                                           quiz_id, answers))
+                print(f'{mode:>5} {concurrency:>6} {rate:>8.1f} '
+                      f'{common.percentile(latencies, 0.5) * 1000:>8.1f} '
+                      f'{common.percentile(latencies, 0.95) * 1000:>8.1f} {len(errors):>7}')
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
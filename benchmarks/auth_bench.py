@@ -0,0 +1,109 @@
+"""Authenticated requests and logins per second, before and after caching.
+
+Authenticated requests: every simulated student fetches their attempt
+history in a loop, with the per-worker user cache off (USER_CACHE_TTL=0, a
+user row read per request) and on. Logins: every student logs in at once,
+with hashing on the request thread (PASSWORD_HASH_THREADS=0) and on the
+pool, using full-cost hashes of --hash-method (werkzeug's default, scrypt,
+unless given).
+
+    python benchmarks/auth_bench.py --students 50 --requests 40 --logins 4
+    python benchmarks/auth_bench.py --hash-method pbkdf2:sha256:100000
+"""
+import argparse
+import os
+import threading
+import time
+
+import common
+
+
+def _storm(students, function):
+    # Runs function(i) for every student at once; returns the elapsed seconds
+    barrier = threading.Barrier(students)
+
+    def student(i):
+        barrier.wait()
+        function(i)
+
+    threads = [threading.Thread(target=student, args=(i,)) for i in range(students)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def authenticated(label, ttl, students, requests):
+    from app import app
+
+    app.config['USER_CACHE_TTL'] = ttl
+    clients = []
+    for i in range(students):
+        client = app.test_client()
+        client.post('/login', data={'username': f'student{i}', 'password': common.PASSWORD})
+        clients.append(client)
+    errors = []
+
+    def browse(i):
+        for _ in range(requests):
+            response = clients[i].get('/user/attempts')
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    elapsed = _storm(students, browse)
+    total = students * requests
+    print(f'{label:>14}: {total} requests, {len(errors)} errors, {total / elapsed:8.1f} requests/s')
+
+
+def logins(label, threads, students, rounds):
+    from app import app
+
+    app.config['PASSWORD_HASH_THREADS'] = threads
+    failures = []
+
+    def log_in(i):
+        client = app.test_client()
+        for _ in range(rounds):
+            response = client.post('/login', data={'username': f'student{i}', 'password': common.PASSWORD})
+            if response.status_code != 302:
+                failures.append(response.status_code)
+            client.get('/logout')
+
+    elapsed = _storm(students, log_in)
+    total = students * rounds
+    print(f'{label:>14}: {total} logins, {len(failures)} failed, {total / elapsed:8.1f} logins/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=40, help='authenticated requests per student')
+    parser.add_argument('--logins', type=int, default=4, help='logins per student')
+    parser.add_argument('--hash-method', default='scrypt')
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1, help='password hashing pool size')
+    args = parser.parse_args()
+
+    common.use_scratch_database()
+    common.seed_quiz(args.students, 10)
+
+    from werkzeug.security import generate_password_hash
+    from app import app, db
+    from models import User
+
+    authenticated('uncached users', 0, args.students, args.requests)
+    authenticated('cached users', 30, args.students, args.requests)
+
+    # One full-cost hash shared by every student; logins then verify it
+    # without re-hashing, since it matches the configured method
+    app.config['PASSWORD_HASH_METHOD'] = args.hash_method
+    with app.app_context():
+        User.query.update({'password_hash': generate_password_hash(common.PASSWORD, args.hash_method)})
+        db.session.commit()
+    logins('inline hashing', 0, args.students, args.logins)
+    logins('hashing pool', args.threads, args.students, args.logins)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Shared setup for the benchmark scripts.
+
+Benchmarks run against a throwaway SQLite database unless DATABASE_URL is
+set; call use_scratch_database() before anything imports the app.
+"""
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+PASSWORD = 'pw'
+CHEAP_HASH_METHOD = 'pbkdf2:sha256:1'
+
+# Seeded users get cheap hashes; a matching method keeps their first login
+# from replacing them with full-cost ones
+os.environ.setdefault('PASSWORD_HASH_METHOD', CHEAP_HASH_METHOD)
+
+
+def use_scratch_database():
+    workdir = tempfile.mkdtemp(prefix='quizmaster-bench-')
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{workdir}/bench.db')
+    return os.environ['DATABASE_URL']
+
+
+@contextmanager
+def local_postgres():
+    """Run a throwaway PostgreSQL cluster and yield its URL.
+
+    Needs initdb and pg_ctl on PATH (or PG_BIN pointing at them); the
+    cluster only listens on a unix socket in its own temporary directory.
+    """
+    pg_bin = os.environ.get('PG_BIN', '')
+    initdb = shutil.which(os.path.join(pg_bin, 'initdb') if pg_bin else 'initdb')
+    pg_ctl = shutil.which(os.path.join(pg_bin, 'pg_ctl') if pg_bin else 'pg_ctl')
+    if initdb is None or pg_ctl is None:
+        sys.exit('initdb/pg_ctl not found; install PostgreSQL or set PG_BIN')
+    workdir = tempfile.mkdtemp(prefix='quizmaster-pg-')
+    data = os.path.join(workdir, 'data')
+    port = free_port()
+    subprocess.run([initdb, '-D', data, '-U', 'postgres', '--auth=trust'], check=True,
+                   stdout=subprocess.DEVNULL)
+    subprocess.run([pg_ctl, '-D', data, '-w', '-l', os.path.join(workdir, 'log'),
+                    '-o', f"-p {port} -k {workdir} -c listen_addresses=''"],
+                   check=True, stdout=subprocess.DEVNULL)
+    try:
+        yield f'postgresql://postgres@/postgres?host={workdir}&port={port}'
+    finally:
+        subprocess.run([pg_ctl, '-D', data, '-m', 'fast', 'stop'], stdout=subprocess.DEVNULL)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(command, env=None):
+    """Start command(port) from the repository root; returns (process, base URL)
+    once the port accepts connections."""
+    port = free_port()
+    server = subprocess.Popen(command(port), cwd=ROOT, env=env or os.environ,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return server, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    sys.exit(f'{command(port)[0]} did not start on port {port}')
+
+
+def cheap_password_hash():
+    # A single hash round keeps logins out of the measurements
+    from werkzeug.security import generate_password_hash
+    return generate_password_hash(PASSWORD, method=CHEAP_HASH_METHOD)
+
+
+def create_schema():
+    # What `flask migrate-db` does; the app no longer creates tables itself
+    from app import app
+    import migrations
+
+    with app.app_context():
+        migrations.upgrade()
+
+
+def seed_quiz(students, questions):
+    """Create `students` users and one quiz open today; returns
+    (quiz id, question ids). Students are named student0, student1, ..."""
+    from app import app, db
+    from models import User, Subject, Chapter, Quiz, Question
+    import leaderboards
+    import rollups
+
+    create_schema()
+    with app.app_context():
+        chapter = Chapter(name='Bench', subject=Subject(name='Bench'))
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        quiz = Quiz(title='Bench', chapter=chapter, duration=10,
+                    start_date=today, end_date=today.replace(hour=23, minute=59, second=59))
+        db.session.add(quiz)
+        for i in range(questions):
+            db.session.add(Question(quiz=quiz, question_text=f'Q{i}', option_a='a', option_b='b',
+                                    option_c='c', option_d='d', correct_answer='A'))
+        password_hash = cheap_password_hash()
+        for i in range(students):
+            db.session.add(User(username=f'student{i}', email=f'student{i}@example.com',
+                                password_hash=password_hash))
+        db.session.flush()
+        rollups.quiz_added(quiz)
+        leaderboards.quiz_added(quiz)
+        db.session.commit()
+        return quiz.id, [q.id for q in quiz.questions]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
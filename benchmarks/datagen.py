@@ -0,0 +1,153 @@
+"""Populate the schema with a synthetic dataset.
+
+Rows are generated from a seeded RNG, so the same scale and seed always give
+the same data. Each quiz is open for a single day within the past year, and
+a tenth of them are open today; attempts fall inside their quiz's day. The
+rollup and leaderboard tables are rebuilt at the end, as after
+`flask rebuild-stats` and `flask rebuild-leaderboards`.
+
+    python benchmarks/datagen.py --scale small
+    python benchmarks/datagen.py --scale large --database-url postgresql://...
+    python benchmarks/datagen.py --users 500 --attempts 100000
+
+Users are `admin` and `student0`..`studentN`, all with the password in
+common.PASSWORD.
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import common
+
+SCALES = {
+    'tiny': dict(users=50, subjects=5, quizzes=50, attempts=2_000),
+    'small': dict(users=500, subjects=20, quizzes=500, attempts=50_000),
+    'medium': dict(users=2_000, subjects=100, quizzes=5_000, attempts=1_000_000),
+    'large': dict(users=10_000, subjects=500, quizzes=50_000, attempts=20_000_000),
+}
+CHAPTERS_PER_SUBJECT = 5
+QUESTIONS_PER_QUIZ = 10
+OPEN_FRACTION = 0.1
+CHUNK_SIZE = 10_000
+
+
+def _insert(model, rows):
+    from sqlalchemy import insert
+    from app import db
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            db.session.execute(insert(model), chunk)
+            db.session.commit()
+            chunk = []
+    if chunk:
+        db.session.execute(insert(model), chunk)
+        db.session.commit()
+
+
+def _quiz_windows(rng, quizzes, now):
+    # A quiz is open for one day, as add_quiz and edit_quiz set it
+    windows = []
+    for _ in range(quizzes):
+        if rng.random() < OPEN_FRACTION:
+            day = now
+        else:
+            day = now - timedelta(days=rng.randint(1, 365))
+        windows.append((day.replace(hour=0, minute=0, second=0, microsecond=0),
+                        day.replace(hour=23, minute=59, second=59, microsecond=0)))
+    return windows
+
+
+def generate(users, subjects, quizzes, attempts, seed=0):
+    """Fill an empty database; returns the row counts per table."""
+    from sqlalchemy import text
+    from app import app, db
+    from models import User, Subject, Chapter, Quiz, Question, QuizAttempt
+    import content
+    import leaderboards
+    import migrations
+    import rollups
+
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    chapters = subjects * CHAPTERS_PER_SUBJECT
+    windows = _quiz_windows(rng, quizzes, now)
+    password_hash = common.cheap_password_hash()
+
+    with app.app_context():
+        migrations.upgrade()
+        if db.session.query(User.id).first() is not None:
+            raise SystemExit('The database is not empty')
+
+        # Explicit ids, so rows can reference each other without reading back
+        _insert(User, [{'id': 1, 'username': 'admin', 'email': 'admin@example.com',
+                        'password_hash': password_hash, 'is_admin': True}])
+        _insert(User, ({'id': i + 2, 'username': f'student{i}', 'email': f'student{i}@example.com',
+                        'password_hash': password_hash, 'is_admin': False} for i in range(users)))
+        _insert(Subject, ({'id': i + 1, 'name': f'Subject {i + 1}'} for i in range(subjects)))
+        _insert(Chapter, ({'id': i + 1, 'name': f'Chapter {i + 1}', 'subject_id': i // CHAPTERS_PER_SUBJECT + 1}
+                          for i in range(chapters)))
+        _insert(Quiz, ({'id': i + 1, 'title': f'Quiz {i + 1}', 'chapter_id': rng.randint(1, chapters),
+                        'duration': rng.choice((10, 15, 20, 30, 45, 60)),
+                        'start_date': start, 'end_date': end}
+                       for i, (start, end) in enumerate(windows)))
+        _insert(Question, ({'id': i + 1, 'quiz_id': i // QUESTIONS_PER_QUIZ + 1,
+                            'question_text': f'Question {i + 1}?',
+                            'option_a': 'Option A', 'option_b': 'Option B',
+                            'option_c': 'Option C', 'option_d': 'Option D',
+                            'correct_answer': rng.choice('ABCD')}
+                           for i in range(quizzes * QUESTIONS_PER_QUIZ)))
+
+        def attempt_rows():
+            for i in range(attempts):
+                quiz_id = rng.randint(1, quizzes)
+                start, end = windows[quiz_id - 1]
+                span = (min(end, now) - start).total_seconds()
+                yield {'id': i + 1, 'user_id': rng.randint(2, users + 1), 'quiz_id': quiz_id,
+                       'score': rng.randint(0, QUESTIONS_PER_QUIZ), 'question_count': QUESTIONS_PER_QUIZ,
+                       'completed_at': start + timedelta(seconds=rng.uniform(0, max(span, 0)))}
+
+        _insert(QuizAttempt, attempt_rows())
+
+        if db.engine.dialect.name == 'postgresql':
+            # The sequences did not see the explicit ids
+            for table in ('user', 'subject', 'chapter', 'quiz', 'question', 'quiz_attempt'):
+                db.session.execute(text(f'SELECT setval(pg_get_serial_sequence(\'"{table}"\', \'id\'), '
+                                        f'(SELECT max(id) FROM "{table}"))'))
+
+        rollups.rebuild()
+        rollups.rebuild_user_stats()
+        leaderboards.rebuild()
+        content.bump_content_version()
+        db.session.commit()
+
+    return {'users': users + 1, 'subjects': subjects, 'chapters': chapters, 'quizzes': quizzes,
+            'questions': quizzes * QUESTIONS_PER_QUIZ, 'attempts': attempts}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    for name in SCALES['small']:
+        parser.add_argument(f'--{name}', type=int, help=f'overrides the scale\'s {name}')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database-url', help='defaults to a new SQLite file in a temporary directory')
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    url = args.database_url or common.use_scratch_database()
+    sizes = {name: getattr(args, name) or default for name, default in SCALES[args.scale].items()}
+
+    started = time.perf_counter()
+    counts = generate(seed=args.seed, **sizes)
+    print(', '.join(f'{count} {table}' for table, count in counts.items()))
+    print(f'Generated in {time.perf_counter() - started:.1f}s into {url}')
+
+
+if __name__ == '__main__':
+    main()
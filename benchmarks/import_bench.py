@@ -0,0 +1,103 @@
+"""Loading a question bank: the add_quiz form path against bulk import.
+
+Creates a quiz with N questions through the existing form submission, then
+imports the same N questions from a CSV upload into an empty quiz, against
+a throwaway SQLite database (or DATABASE_URL when set).
+
+    python benchmarks/import_bench.py --questions 2000
+"""
+import argparse
+import csv
+import io
+import time
+from datetime import datetime
+
+import common
+
+
+def setup():
+    from app import app, db
+    from models import User, Subject, Chapter
+
+    common.create_schema()
+    with app.app_context():
+        admin = User(username='admin', email='admin@example.com', is_admin=True,
+                     password_hash=common.cheap_password_hash())
+        chapter = Chapter(name='Bench', subject=Subject(name='Bench'))
+        db.session.add_all([admin, chapter])
+        db.session.commit()
+        chapter_id = chapter.id
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': common.PASSWORD})
+    return client, chapter_id
+
+
+def bank(questions):
+    return [
+        {
+            'question_text': f'Question {i}?',
+            'option_a': f'{i} a', 'option_b': f'{i} b', 'option_c': f'{i} c', 'option_d': f'{i} d',
+            'correct_answer': 'ABCD'[i % 4]
+        }
+        for i in range(questions)
+    ]
+
+
+def quiz_form(title, rows):
+    form = {'title': title, 'start_date': datetime.utcnow().strftime('%Y-%m-%d'), 'duration': '30'}
+    for i, row in enumerate(rows):
+        form[f'questions[{i}][text]'] = row['question_text']
+        for option in ('option_a', 'option_b', 'option_c', 'option_d'):
+            form[f'questions[{i}][{option}]'] = row[option]
+        form[f'questions[{i}][correct]'] = row['correct_answer']
+    return form
+
+
+def question_count(title):
+    from app import app
+    from models import Quiz
+    with app.app_context():
+        return len(Quiz.query.filter_by(title=title).one().questions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--questions', type=int, default=2000)
+    args = parser.parse_args()
+
+    common.use_scratch_database()
+    client, chapter_id = setup()
+    rows = bank(args.questions)
+
+    start = time.perf_counter()
+    client.post(f'/admin/quiz/add/{chapter_id}', data=quiz_form('Form', rows))
+    form_seconds = time.perf_counter() - start
+    assert question_count('Form') == args.questions
+
+    client.post(f'/admin/quiz/add/{chapter_id}', data=quiz_form('Import', []))
+    from app import app
+    from models import Quiz
+    with app.app_context():
+        quiz_id = Quiz.query.filter_by(title='Import').one().id
+    upload = io.StringIO()
+    writer = csv.DictWriter(upload, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    payload = upload.getvalue().encode()
+
+    start = time.perf_counter()
+    client.post(f'/admin/quiz/{quiz_id}/import',
+                data={'file': (io.BytesIO(payload), 'bank.csv')},
+                content_type='multipart/form-data')
+    import_seconds = time.perf_counter() - start
+    assert question_count('Import') == args.questions
+
+    print(f'  form: {args.questions} questions in {form_seconds:7.3f}s '
+          f'({args.questions / form_seconds:9.1f}/s)')
+    print(f'import: {args.questions} questions in {import_seconds:7.3f}s '
+          f'({args.questions / import_seconds:9.1f}/s)')
+
+
+if __name__ == '__main__':
+    main()
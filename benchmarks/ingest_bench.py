@@ -0,0 +1,82 @@
+"""Submissions per second through submit_quiz, with and without batching.
+
+Simulates a deadline storm: every simulated student submits at once, each
+from its own thread and test client, against a throwaway SQLite database
+(or DATABASE_URL when set).
+
+    python benchmarks/ingest_bench.py --students 50 --submissions 20
+"""
+import argparse
+import threading
+import time
+from datetime import datetime
+
+import common
+
+
+def run(mode, students, submissions, quiz_id, question_ids):
+    from app import app, db
+    from models import User, QuizAttempt
+    import quiz_sessions
+
+    app.config['ATTEMPT_INGEST'] = mode
+    with app.app_context():
+        before = QuizAttempt.query.count()
+        user_ids = [User.query.filter_by(username=f'student{i}').one().id for i in range(students)]
+
+    clients = []
+    for i in range(students):
+        client = app.test_client()
+        client.post('/login', data={'username': f'student{i}', 'password': common.PASSWORD})
+        clients.append(client)
+
+    form = {f'question_{qid}': 'A' for qid in question_ids}
+    errors = []
+    barrier = threading.Barrier(students)
+
+    def student(client, user_id):
+        barrier.wait()
+        for _ in range(submissions):
+            # Submissions need a quiz in progress; starting one directly keeps
+            # page rendering out of the measurement
+            with app.app_context():
+                quiz_sessions.begin(user_id, quiz_id, 10, datetime.utcnow())
+            response = client.post(f'/user/quiz/{quiz_id}/submit', data=form)
+            if response.status_code != 302:
+                errors.append(response.status_code)
+
+    threads = [threading.Thread(target=student, args=(c, u)) for c, u in zip(clients, user_ids)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    accepted = time.perf_counter() - start
+
+    expected = before + students * submissions - len(errors)
+    with app.app_context():
+        while QuizAttempt.query.count() < expected:
+            time.sleep(0.01)
+            db.session.remove()
+    stored = time.perf_counter() - start
+
+    total = students * submissions
+    print(f'{mode:>8}: {total} submissions, {len(errors)} errors, '
+          f'{total / accepted:8.1f}/s accepted, {total / stored:8.1f}/s stored')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=50)
+    parser.add_argument('--submissions', type=int, default=20)
+    parser.add_argument('--questions', type=int, default=20)
+    args = parser.parse_args()
+
+    common.use_scratch_database()
+    quiz_id, question_ids = common.seed_quiz(args.students, args.questions)
+    for mode in ('sync', 'batched'):
+        run(mode, args.students, args.submissions, quiz_id, question_ids)
+
+
+if __name__ == '__main__':
+    main()
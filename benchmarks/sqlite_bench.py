@@ -0,0 +1,66 @@
+"""Throughput of several workers on one SQLite file, with and without tuning.
+
+Starts gunicorn with --workers sync workers over a copy of the same seeded
+database, once as configured by default and once with SQLITE_TUNING=1 (WAL,
+pragmas, one serialised writer per worker, query-only readers; see
+sqlite_tuning.py), and has --students virtual students loop over dashboard
+-> take quiz -> submit for --duration seconds at each concurrency level.
+Every submission is a write, so this is the submission-burst case;
+"database is locked" failures show up as errors.
+
+    python benchmarks/sqlite_bench.py --workers 4 --concurrency 20 100
+
+Needs gunicorn and httpx.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+
+import common
+from asgi_bench import load
+
+PROFILES = {
+    'default': {'SQLITE_TUNING': '0'},
+    'tuned': {'SQLITE_TUNING': '1'},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[20, 100])
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per level')
+    parser.add_argument('--questions', type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ.pop('DATABASE_URL', None)
+    seeded = common.use_scratch_database().removeprefix('sqlite:///')
+    quiz_id, question_ids = common.seed_quiz(max(args.concurrency), args.questions)
+    answers = {f'question_{question_id}': 'A' for question_id in question_ids}
+
+    def gunicorn(port):
+        return ['gunicorn', '-w', str(args.workers), '-k', 'sync', '-b', f'127.0.0.1:{port}', 'app:app']
+
+    print(f'{"profile":>8} {"users":>6} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"errors":>7}')
+    for profile, settings in PROFILES.items():
+        # Each profile starts from the same rollback-journal database, since
+        # switching to WAL sticks to the file
+        database = f'{seeded}.{profile}'
+        shutil.copy(seeded, database)
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{database}', **settings)
+        server, base_url = common.start_server(gunicorn, env)
+        try:
+            for concurrency in args.concurrency:
+                rate, latencies, errors = asyncio.run(load(base_url, concurrency, args.duration,
+                                                           quiz_id, answers))
+                print(f'{profile:>8} {concurrency:>6} {rate:>8.1f} '
+                      f'{common.percentile(latencies, 0.5) * 1000:>8.1f} '
+                      f'{common.percentile(latencies, 0.95) * 1000:>8.1f} {len(errors):>7}')
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
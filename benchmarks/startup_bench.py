@@ -0,0 +1,115 @@
+"""Worker cold start and memory under gunicorn, with and without --preload.
+
+Loading the app: a fresh interpreter imports the app module and builds the
+application, which is what every worker pays at boot unless the app is
+preloaded. Servers: gunicorn starts --workers sync workers over a seeded
+database, once loading the app in every worker (GUNICORN_PRELOAD=0) and once
+preloading it in the master and forking, as gunicorn.conf.py does by
+default. Each serves --requests logged-in dashboard and quiz requests, then
+the memory of the master and workers is read from /proc/<pid>/smaps_rollup.
+Private memory is what a worker does not share with the master or the other
+workers; PSS splits shared pages between their users, so the total is what
+the server really costs.
+
+    python benchmarks/startup_bench.py --workers 4 --requests 200
+
+Needs gunicorn and httpx, and Linux for /proc.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import common
+
+LOAD_APP = 'import time; start = time.perf_counter(); from app import app; print(time.perf_counter() - start)'
+
+
+def load_time(runs):
+    # Median over fresh interpreters, so nothing is cached in-process
+    times = sorted(float(subprocess.run([sys.executable, '-c', LOAD_APP], cwd=common.ROOT, check=True,
+                                        capture_output=True, text=True).stdout)
+                   for _ in range(runs))
+    return times[len(times) // 2]
+
+
+def _memory(pid):
+    # KiB per smaps_rollup field
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if value.strip().endswith('kB'):
+                fields[name] = int(value.split()[0])
+    return fields
+
+
+def _workers(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def _ready(client, deadline):
+    while time.monotonic() < deadline:
+        try:
+            if client.get('/login').status_code == 200:
+                return True
+        except Exception:
+            pass
+        time.sleep(0.02)
+    return False
+
+
+def serve(label, preload, args, quiz_id):
+    import httpx
+
+    port = common.free_port()
+    command = ['gunicorn', '-w', str(args.workers), '-k', 'sync', '-b', f'127.0.0.1:{port}', 'app:app']
+    env = dict(os.environ, GUNICORN_PRELOAD='1' if preload else '0')
+    start = time.monotonic()
+    server = subprocess.Popen(command, cwd=common.ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        with httpx.Client(base_url=f'http://127.0.0.1:{port}') as client:
+            if not _ready(client, start + 60):
+                sys.exit(f'gunicorn did not start on port {port}')
+            first_response = time.monotonic() - start
+            client.post('/login', data={'username': 'student0', 'password': common.PASSWORD})
+            for _ in range(args.requests // 2):
+                client.get('/user/dashboard')
+                client.get(f'/user/quiz/{quiz_id}')
+        workers = [_memory(pid) for pid in _workers(server.pid)]
+        master = _memory(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+    def private(fields):
+        return fields['Private_Clean'] + fields['Private_Dirty']
+
+    pss = sum(fields['Pss'] for fields in workers) + master['Pss']
+    print(f'{label:>10} {first_response * 1000:>10.0f} {len(workers):>8} '
+          f'{sum(w["Rss"] for w in workers) / len(workers) / 1024:>10.1f} '
+          f'{sum(private(w) for w in workers) / len(workers) / 1024:>11.1f} '
+          f'{pss / 1024:>10.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200, help='requests after startup')
+    parser.add_argument('--runs', type=int, default=5, help='interpreters timed loading the app')
+    args = parser.parse_args()
+
+    common.use_scratch_database()
+    quiz_id, _ = common.seed_quiz(1, 10)
+
+    print(f'loading the app: {load_time(args.runs) * 1000:.0f} ms per process')
+    print(f'{"mode":>10} {"first ms":>10} {"workers":>8} {"RSS MiB":>10} {"priv. MiB":>11} {"PSS MiB":>10}')
+    serve('per-worker', False, args, quiz_id)
+    serve('preload', True, args, quiz_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""Route benchmarks against a stored baseline.
+
+Generates a synthetic dataset (see datagen.py), then drives the real routes
+through the Flask test client and records, per route, latency percentiles,
+SQL statements per request and peak Python allocations per request. Results
+are compared with baseline.json, and the run exits non-zero when a route
+started issuing more queries or allocating more memory than the baseline
+allows. Latencies are printed next to their baseline for reference only.
+
+    python benchmarks/suite.py                          # SQLite, small scale
+    python benchmarks/suite.py --backend sqlite postgresql
+    python benchmarks/suite.py --database-url postgresql://... --scale large
+    python benchmarks/suite.py --update-baseline
+
+postgresql starts a throwaway local cluster (initdb and pg_ctl on PATH, or
+PG_BIN); --database-url runs against an already generated database instead.
+Each backend runs in its own process, since the app binds its database at
+import time. Latencies depend on the machine and on whatever else it is
+running, so they never fail the run; to judge a latency change, run
+--update-baseline on the old code and compare on the same machine.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime
+
+import common
+import datagen
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Allowed growth over the baseline, as a fraction; queries must not grow at all
+TOLERANCES = {'queries': 0.0, 'peak_kib': 0.25}
+# Reported as a ratio to the baseline, but too noisy to fail on
+INFORMATIONAL = ('p50_ms', 'p95_ms')
+MEMORY_SAMPLES = 5
+
+Scenario = namedtuple('Scenario', 'user method path data prepare')
+
+
+def scenarios(client_ids):
+    quiz_id = client_ids['quiz_id']
+    answers = {f'question_{question_id}': 'A' for question_id in client_ids['question_ids']}
+
+    def start_quiz(client):
+        # submit_quiz needs a quiz in progress
+        client.get(f'/user/quiz/{quiz_id}')
+
+    return {
+        'admin.dashboard': Scenario('admin', 'GET', '/admin/dashboard', None, None),
+        'admin.quiz_results': Scenario('admin', 'GET', f'/admin/quiz/{quiz_id}/results', None, None),
+        'user.user_dashboard': Scenario('student0', 'GET', '/user/dashboard', None, None),
+        'user.attempt_history': Scenario('student0', 'GET', '/user/attempts', None, None),
+        'user.leaderboard': Scenario('student0', 'GET', '/user/leaderboard', None, None),
+        'user.take_quiz': Scenario('student0', 'GET', f'/user/quiz/{quiz_id}', None, None),
+        'user.submit_quiz': Scenario('student0', 'POST', f'/user/quiz/{quiz_id}/submit', answers, start_quiz),
+    }
+
+
+def _percentile_ms(samples, fraction):
+    return round(common.percentile(samples, fraction) * 1000, 2)
+
+
+def _request(client, scenario):
+    if scenario.prepare:
+        scenario.prepare(client)
+    started = time.perf_counter()
+    response = client.open(scenario.path, method=scenario.method, data=scenario.data)
+    elapsed = time.perf_counter() - started
+    if response.status_code >= 400:
+        raise SystemExit(f'{scenario.method} {scenario.path} returned {response.status_code}')
+    return elapsed, int(response.headers['X-Query-Count'])
+
+
+def measure(requests, warmup):
+    """Run every scenario in this process; returns {route: metrics}."""
+    from app import app
+    from models import Quiz, Question
+
+    now = datetime.utcnow()
+    with app.app_context():
+        quiz = Quiz.query.filter(Quiz.start_date <= now, Quiz.end_date >= now).order_by(Quiz.id).first()
+        if quiz is None:
+            raise SystemExit('The dataset has no quiz open today')
+        question_ids = [question_id for (question_id,) in
+                        Question.query.with_entities(Question.id).filter_by(quiz_id=quiz.id)]
+
+    clients = {}
+    results = {}
+    for name, scenario in scenarios({'quiz_id': quiz.id, 'question_ids': question_ids}).items():
+        client = clients.get(scenario.user)
+        if client is None:
+            client = clients[scenario.user] = app.test_client()
+            client.post('/login', data={'username': scenario.user, 'password': common.PASSWORD})
+
+        for _ in range(warmup):
+            _request(client, scenario)
+        latencies = []
+        queries = []
+        for _ in range(requests):
+            elapsed, count = _request(client, scenario)
+            latencies.append(elapsed)
+            queries.append(count)
+
+        # A separate pass, since tracing allocations slows every request down
+        tracemalloc.start()
+        peak = 0
+        for _ in range(MEMORY_SAMPLES):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            _request(client, scenario)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+
+        results[name] = {
+            'p50_ms': _percentile_ms(latencies, 0.5),
+            'p95_ms': _percentile_ms(latencies, 0.95),
+            'p99_ms': _percentile_ms(latencies, 0.99),
+            'queries': max(queries),
+            'peak_kib': round(peak / 1024, 1),
+        }
+    return results
+
+
+def compare(results, baseline):
+    """Return (lines of the report, number of regressions)."""
+    lines = [f'{"route":<24} {"metric":<9} {"baseline":>10} {"current":>10} {"ratio":>6}']
+    regressions = 0
+    for route, metrics in results.items():
+        expected = baseline.get(route)
+        if expected is None:
+            lines.append(f'{route:<24} (not in baseline)')
+            continue
+        for metric, tolerance in TOLERANCES.items():
+            if metric not in expected:
+                continue
+            limit = expected[metric] * (1 + tolerance)
+            worse = metrics[metric] > limit
+            regressions += worse
+            lines.append(_line(route, metric, expected[metric], metrics[metric], '  REGRESSION' if worse else ''))
+        for metric in INFORMATIONAL:
+            if metric in expected:
+                lines.append(_line(route, metric, expected[metric], metrics[metric], ''))
+    return lines, regressions
+
+
+def _line(route, metric, expected, current, note):
+    ratio = f'{current / expected:.2f}' if expected else '-'
+    return f'{route:<24} {metric:<9} {expected:>10} {current:>10} {ratio:>6}{note}'
+
+
+def run_backend(backend, args):
+    # Runs this script as a worker for one database and returns its results
+    env = dict(os.environ, QUERY_COUNTER='1')
+    command = [sys.executable, os.path.abspath(__file__), '--worker', '--scale', args.scale,
+               '--seed', str(args.seed), '--requests', str(args.requests), '--warmup', str(args.warmup)]
+    if args.database_url:
+        env['DATABASE_URL'] = args.database_url
+        command.append('--existing')
+        return _run_worker(command, env)
+    if backend == 'postgresql':
+        with common.local_postgres() as url:
+            env['DATABASE_URL'] = url
+            return _run_worker(command, env)
+    env.pop('DATABASE_URL', None)
+    return _run_worker(command, env)
+
+
+def _run_worker(command, env):
+    output = subprocess.run(command, env=env, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def worker(args):
+    if not args.existing:
+        if 'DATABASE_URL' not in os.environ:
+            common.use_scratch_database()
+        datagen.generate(seed=args.seed, **datagen.SCALES[args.scale])
+    print(json.dumps(measure(args.requests, args.warmup)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--backend', nargs='+', choices=('sqlite', 'postgresql'), default=['sqlite'])
+    parser.add_argument('--scale', choices=datagen.SCALES, default='small')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=50, help='timed requests per route')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--database-url', help='an already generated database (skips generation)')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--existing', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args)
+
+    backends = args.backend
+    if args.database_url:
+        backends = ['postgresql' if args.database_url.startswith('postgresql') else 'sqlite']
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+
+    regressions = 0
+    for backend in backends:
+        key = f'{backend}/{args.scale}'
+        results = run_backend(backend, args)
+        print(f'== {key}')
+        if args.update_baseline:
+            baseline[key] = results
+            for route, metrics in results.items():
+                print(f'{route:<24} ' + '  '.join(f'{metric} {value}' for metric, value in metrics.items()))
+            continue
+        lines, found = compare(results, baseline.get(key, {}))
+        print('\n'.join(lines))
+        regressions += found
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as handle:
+            json.dump(baseline, handle, indent=2, sort_keys=True)
+            handle.write('\n')
+        print(f'Baseline written to {args.baseline}')
+    elif regressions:
+        print(f'\n{regressions} metric(s) regressed beyond the baseline tolerance', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
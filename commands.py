@@ -0,0 +1,133 @@
+import click
+from datetime import datetime
+from flask import Blueprint
+from app import db
+from models import Quiz
+import rollups
+import migrations
+import query_plans
+import export
+import question_import
+import content
+import grading
+import quiz_sessions
+import leaderboards
+
+# Registered by create_app(); the commands are top-level `flask` commands
+commands_bp = Blueprint('commands', __name__, cli_group=None)
+
+
+@commands_bp.cli.command('rebuild-stats')
+def rebuild_stats():
+    """Recompute the dashboard rollup tables from scratch."""
+    quizzes, subjects = rollups.rebuild()
+    db.session.commit()
+    click.echo(f'Rebuilt statistics for {quizzes} quizzes across {subjects} subjects')
+
+
+@commands_bp.cli.command('rebuild-user-stats')
+def rebuild_user_stats():
+    """Backfill the per-user dashboard tables from existing attempts."""
+    subject_rows, month_rows = rollups.rebuild_user_stats()
+    db.session.commit()
+    click.echo(f'Rebuilt {subject_rows} user/subject and {month_rows} user/month rows')
+
+
+@commands_bp.cli.command('rebuild-leaderboards')
+def rebuild_leaderboards():
+    """Recompute the leaderboards from existing attempts (after rebuild-stats)."""
+    entries = leaderboards.rebuild()
+    db.session.commit()
+    click.echo(f'Rebuilt {entries} leaderboard entries')
+
+
+@commands_bp.cli.command('migrate-db')
+@click.option('--check', is_flag=True, help='Only report missing tables and pending migrations; exit 1 if there are any.')
+def migrate_db(check):
+    """Create missing tables and apply pending schema migrations."""
+    if check:
+        tables = migrations.missing_tables()
+        steps = migrations.pending()
+        if tables:
+            click.echo('Missing tables: ' + ', '.join(tables))
+        for version, description, _ in steps:
+            click.echo(f'Pending migration {version}: {description}')
+        if tables or steps:
+            raise SystemExit(1)
+        click.echo('Schema is up to date')
+        return
+    applied = migrations.upgrade()
+    for version, description in applied:
+        click.echo(f'Applied migration {version}: {description}')
+    if not applied:
+        click.echo('Schema is up to date')
+
+
+@commands_bp.cli.command('check-query-plans')
+def check_query_plans():
+    """Fail if a hot query would scan its table instead of using an index."""
+    failures = query_plans.check()
+    for name, steps in failures.items():
+        click.echo(f'{name}: ' + '; '.join(steps), err=True)
+    if failures:
+        raise SystemExit(1)
+    click.echo('All hot queries use indexes')
+
+
+def _write_export(output, fmt, columns, rows, gzip):
+    with click.open_file(output, 'wb') as stream:
+        for chunk in export.encode(fmt, columns, rows, gzip=gzip):
+            stream.write(chunk)
+
+
+@commands_bp.cli.command('export-results')
+@click.option('--quiz-id', type=int, help='Only export attempts at this quiz.')
+@click.option('--format', 'fmt', type=click.Choice(list(export.FORMATS)), default='csv')
+@click.option('--gzip', is_flag=True, help='Gzip the output.')
+@click.option('--output', '-o', default='-', help='File to write to (default: stdout).')
+def export_results(quiz_id, fmt, gzip, output):
+    """Stream quiz attempts with user and quiz details."""
+    _write_export(output, fmt, export.RESULT_COLUMNS, export.result_rows(quiz_id), gzip)
+
+
+@commands_bp.cli.command('export-questions')
+@click.argument('quiz_id', type=int)
+@click.option('--format', 'fmt', type=click.Choice(list(export.FORMATS)), default='csv')
+@click.option('--gzip', is_flag=True, help='Gzip the output.')
+@click.option('--output', '-o', default='-', help='File to write to (default: stdout).')
+def export_questions(quiz_id, fmt, gzip, output):
+    """Stream a quiz's question bank."""
+    _write_export(output, fmt, export.QUESTION_COLUMNS, export.question_rows(quiz_id), gzip)
+
+
+@commands_bp.cli.command('import-questions')
+@click.argument('quiz_id', type=int)
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(question_import.FORMATS),
+              help='Defaults to the file extension.')
+def import_questions(quiz_id, path, fmt):
+    """Bulk-add the questions in a CSV, JSON or NDJSON file to a quiz."""
+    quiz = db.session.get(Quiz, quiz_id)
+    if quiz is None:
+        raise click.ClickException(f'No quiz with id {quiz_id}')
+    fmt = fmt or question_import.format_for(path)
+    if fmt is None:
+        raise click.ClickException('Cannot tell the format from the file name; pass --format')
+
+    with open(path, 'rb') as binary:
+        report = question_import.import_questions(quiz_id, question_import.text_stream(binary), fmt)
+    rollups.quiz_updated(quiz, quiz.start_date)
+    content.bump_content_version()
+    db.session.commit()
+    grading.invalidate(quiz_id)
+
+    for number, error in report.errors:
+        click.echo(f'Row {number} skipped: {error}', err=True)
+    click.echo(f'Imported {report.imported} questions, skipped {len(report.errors)} rows')
+
+
+@commands_bp.cli.command('expire-quiz-sessions')
+def expire_quiz_sessions():
+    """Record the attempts of quiz sessions that ran past their deadline."""
+    expired = quiz_sessions.sweep(datetime.utcnow())
+    click.echo(f'Expired {expired} quiz sessions')
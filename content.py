@@ -0,0 +1,113 @@
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+from sqlalchemy import func, select, update
+from app import db
+from models import Subject, Chapter, Quiz, Question, ContentVersion
+import grading
+
+# Plain, read-only view of the Subject/Chapter/Quiz hierarchy. The attribute
+# names match the models so templates can walk either one, but nothing here
+# lazy-loads: the whole tree costs three queries however large it grows.
+SubjectNode = namedtuple('SubjectNode', 'id name chapters')
+ChapterNode = namedtuple('ChapterNode', 'id name subject_id quizzes')
+# question_count is the number of questions in each attempt
+QuizNode = namedtuple('QuizNode', 'id title chapter_id duration start_date end_date question_count sample_size')
+ContentTree = namedtuple('ContentTree', 'version subjects chapters quizzes')
+
+
+def tree_statements():
+    """The three queries a content tree is built from: subjects, chapters and
+    quizzes with their question counts."""
+    question_counts = select(
+        Question.quiz_id.label('quiz_id'),
+        func.count(Question.id).label('question_count')
+    ).group_by(Question.quiz_id).subquery()
+
+    return (
+        select(Subject.id, Subject.name).order_by(Subject.id),
+        select(Chapter.id, Chapter.name, Chapter.subject_id).order_by(Chapter.id),
+        select(
+            Quiz.id, Quiz.title, Quiz.chapter_id, Quiz.duration, Quiz.start_date, Quiz.end_date,
+            func.coalesce(question_counts.c.question_count, 0), Quiz.sample_size
+        ).outerjoin(question_counts, question_counts.c.quiz_id == Quiz.id).order_by(Quiz.id)
+    )
+
+
+def _group(nodes, key):
+    groups = {}
+    for node in nodes:
+        groups.setdefault(getattr(node, key), []).append(node)
+    return groups
+
+
+def build_tree(version, subject_rows, chapter_rows, quiz_rows):
+    quizzes = [
+        QuizNode(id, title, chapter_id, duration, start_date, end_date,
+                 grading.questions_per_attempt(question_count, sample_size), sample_size)
+        for id, title, chapter_id, duration, start_date, end_date, question_count, sample_size in quiz_rows
+    ]
+    quizzes_by_chapter = _group(quizzes, 'chapter_id')
+
+    chapters = [
+        ChapterNode(id, name, subject_id, tuple(quizzes_by_chapter.get(id, ())))
+        for id, name, subject_id in chapter_rows
+    ]
+    chapters_by_subject = _group(chapters, 'subject_id')
+
+    subjects = tuple(
+        SubjectNode(id, name, tuple(chapters_by_subject.get(id, ())))
+        for id, name in subject_rows
+    )
+    return ContentTree(
+        version=version,
+        subjects=subjects,
+        chapters=MappingProxyType({chapter.id: chapter for chapter in chapters}),
+        quizzes=MappingProxyType({quiz.id: quiz for quiz in quizzes})
+    )
+
+
+def load_content_tree(version=0):
+    return build_tree(version, *(db.session.execute(stmt).all() for stmt in tree_statements()))
+
+
+# Each worker keeps one snapshot of the tree, tagged with the content version
+# it was built from. Checking the version is a primary-key lookup; the tree is
+# only reloaded after an admin write has bumped it.
+_snapshot = (None, None)
+_snapshot_lock = threading.Lock()
+
+
+VERSION_QUERY = select(ContentVersion.version).where(ContentVersion.id == 1)
+
+
+def content_version():
+    return db.session.execute(VERSION_QUERY).scalar() or 0
+
+
+def cached_tree(version):
+    cached_version, tree = _snapshot
+    return tree if tree is not None and cached_version == version else None
+
+
+def remember_tree(tree):
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot[0] is None or tree.version >= _snapshot[0]:
+            _snapshot = (tree.version, tree)
+    return tree
+
+
+def bump_content_version():
+    # Called in the same transaction as the catalog change it announces
+    stmt = update(ContentVersion).filter_by(id=1)\
+        .values(version=ContentVersion.version + 1)\
+        .execution_options(synchronize_session=False)
+    if db.session.execute(stmt).rowcount == 0:
+        db.session.add(ContentVersion(id=1, version=1))
+        db.session.flush()
+
+
+def catalog():
+    version = content_version()
+    return cached_tree(version) or remember_tree(load_content_tree(version))
@@ -0,0 +1,96 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from app import db
+from models import User, Subject, Chapter, Quiz, Question, QuizAttempt
+
+# Exports are generators from a server-side cursor to encoded chunks, so
+# memory use stays flat however many rows there are. The routes hand them
+# to a streaming response, the CLI commands write them to a file.
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+ROWS_PER_CHUNK = 1000
+YIELD_PER = 1000
+
+RESULT_COLUMNS = ('attempt_id', 'completed_at', 'user_id', 'username', 'email', 'subject', 'chapter',
+                  'quiz_id', 'quiz_title', 'score', 'question_count')
+QUESTION_COLUMNS = ('question_id', 'quiz_id', 'question_text', 'option_a', 'option_b', 'option_c',
+                    'option_d', 'correct_answer')
+
+
+def result_rows(quiz_id=None):
+    query = db.session.query(
+        QuizAttempt.id, QuizAttempt.completed_at, User.id, User.username, User.email,
+        Subject.name, Chapter.name, Quiz.id, Quiz.title, QuizAttempt.score, QuizAttempt.question_count
+    ).join(User, QuizAttempt.user_id == User.id)\
+    .join(Quiz, QuizAttempt.quiz_id == Quiz.id)\
+    .join(Chapter, Quiz.chapter_id == Chapter.id)\
+    .join(Subject, Chapter.subject_id == Subject.id)
+    if quiz_id is not None:
+        query = query.filter(QuizAttempt.quiz_id == quiz_id)
+    return query.order_by(QuizAttempt.id).yield_per(YIELD_PER)
+
+
+def question_rows(quiz_id):
+    return db.session.query(
+        Question.id, Question.quiz_id, Question.question_text, Question.option_a, Question.option_b,
+        Question.option_c, Question.option_d, Question.correct_answer
+    ).filter(Question.quiz_id == quiz_id)\
+    .order_by(Question.id)\
+    .yield_per(YIELD_PER)
+
+
+def _chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == ROWS_PER_CHUNK:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _csv(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for chunk in _chunks(rows):
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _ndjson(columns, rows):
+    for chunk in _chunks(rows):
+        yield ''.join(json.dumps(dict(zip(columns, row)), default=_json_default) + '\n' for row in chunk)
+
+
+def encode(fmt, columns, rows, gzip=False):
+    """Yield the rows as bytes in `fmt` ('csv' or 'ndjson'), gzipped if asked."""
+    text = _csv(columns, rows) if fmt == 'csv' else _ndjson(columns, rows)
+    if not gzip:
+        for piece in text:
+            yield piece.encode()
+        return
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for piece in text:
+        data = compressor.compress(piece.encode())
+        if data:
+            yield data
+    yield compressor.flush()
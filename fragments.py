@@ -0,0 +1,87 @@
+import hashlib
+import inspect
+import threading
+from collections import OrderedDict
+from markupsafe import Markup
+
+# Rendered template fragments, cached per worker. A template wraps a block
+# that only depends on the content catalog in
+#
+#     {% call cached_fragment('user.catalog', catalog_version) %} ... {% endcall %}
+#
+# and the block is rendered once per content version, then served from here.
+# Anything else the block depends on (the viewer's role, say) goes into the
+# key after the version. Storing a fragment drops the ones of the same name
+# from older content versions. Least recently used fragments are evicted once the
+# cache holds more than FRAGMENT_CACHE_BYTES characters of HTML; 0 turns it
+# off.
+#
+# conditional() adds a strong ETag, a hash of the body, to a full page, so a
+# browser revalidating an unchanged page gets a 304 without the body.
+
+_fragments = OrderedDict()
+_fragments_lock = threading.Lock()
+_size = 0
+_max_bytes = 0
+
+
+def init_app(app):
+    global _max_bytes
+    _max_bytes = app.config['FRAGMENT_CACHE_BYTES']
+    app.jinja_env.globals['cached_fragment'] = cached_fragment
+
+
+def _cached(key):
+    with _fragments_lock:
+        html = _fragments.get(key)
+        if html is not None:
+            _fragments.move_to_end(key)
+        return html
+
+
+def _remember(key, html):
+    global _size
+    html = Markup(html)
+    if len(html) > _max_bytes:
+        return html
+    with _fragments_lock:
+        for stale in [k for k in _fragments if k[0] == key[0] and (k[1] < key[1] or k == key)]:
+            _size -= len(_fragments.pop(stale))
+        _fragments[key] = html
+        _size += len(html)
+        while _size > _max_bytes:
+            _, evicted = _fragments.popitem(last=False)
+            _size -= len(evicted)
+    return html
+
+
+def cached_fragment(name, *key, caller):
+    key = (name,) + key
+    html = _cached(key)
+    if html is not None:
+        return html
+    body = caller()
+    if inspect.isawaitable(body):
+        # Templates rendered by the async app get a coroutine from caller();
+        # Jinja awaits the one returned here
+        async def render():
+            return _remember(key, await body)
+        return render()
+    return _remember(key, body)
+
+
+def _tag(response, body):
+    response.set_etag(hashlib.sha1(body).hexdigest())
+    # Per-user pages: browsers may keep them but must revalidate every time
+    response.headers['Cache-Control'] = 'private, no-cache'
+
+
+def conditional(request, response):
+    _tag(response, response.get_data())
+    return response.make_conditional(request)
+
+
+async def async_conditional(request, response):
+    # The same for Quart responses
+    _tag(response, await response.get_data())
+    return await response.make_conditional(request)
@@ -0,0 +1,107 @@
+import random
+import threading
+from bisect import bisect_left
+from collections import namedtuple, OrderedDict
+from sqlalchemy import select
+from app import db
+from models import Question
+
+# Compact answer key for one quiz: the id and form field of every question
+# and its correct option packed into one string, in question id order.
+# Grading never touches Question objects, only these sequences.
+AnswerKey = namedtuple('AnswerKey', 'question_ids fields answers')
+
+MAX_CACHED_KEYS = 2048
+
+# Per-worker cache of quiz id -> (content version, answer key). Keys built
+# under an older content version are rebuilt on their next use, so edits made
+# through any worker are picked up everywhere.
+_keys = OrderedDict()
+_keys_lock = threading.Lock()
+
+
+def answer_key_statement(quiz_id):
+    return select(Question.id, Question.correct_answer)\
+        .where(Question.quiz_id == quiz_id)\
+        .order_by(Question.id)
+
+
+def build_answer_key(rows):
+    return AnswerKey(
+        question_ids=tuple(question_id for question_id, _ in rows),
+        fields=tuple(f'question_{question_id}' for question_id, _ in rows),
+        answers=''.join(correct for _, correct in rows)
+    )
+
+
+def cached_answer_key(quiz_id, version):
+    with _keys_lock:
+        cached = _keys.get(quiz_id)
+        if cached is not None and cached[0] == version:
+            _keys.move_to_end(quiz_id)
+            return cached[1]
+    return None
+
+
+def remember_answer_key(quiz_id, version, key):
+    with _keys_lock:
+        _keys[quiz_id] = (version, key)
+        _keys.move_to_end(quiz_id)
+        while len(_keys) > MAX_CACHED_KEYS:
+            _keys.popitem(last=False)
+    return key
+
+
+def answer_key(quiz_id, version):
+    key = cached_answer_key(quiz_id, version)
+    if key is None:
+        rows = db.session.execute(answer_key_statement(quiz_id)).all()
+        key = remember_answer_key(quiz_id, version, build_answer_key(rows))
+    return key
+
+
+def invalidate(quiz_id):
+    with _keys_lock:
+        _keys.pop(quiz_id, None)
+
+
+def questions_per_attempt(question_count, sample_size):
+    if sample_size is None:
+        return question_count
+    return min(question_count, sample_size)
+
+
+def sample_questions(key, sample_size):
+    """Ids of `sample_size` questions drawn from the quiz, in random order;
+    None when the attempt gets all of them."""
+    if sample_size is None or sample_size >= len(key.question_ids):
+        return None
+    # Random positions in the key's id array, so the draw costs O(sample_size)
+    # whatever the size of the quiz's question bank
+    return [key.question_ids[i] for i in random.sample(range(len(key.question_ids)), sample_size)]
+
+
+def subset(key, question_ids):
+    """The key for just `question_ids`, in id order; questions deleted since
+    they were drawn are left out."""
+    if question_ids is None:
+        return key
+    positions = []
+    for question_id in sorted(question_ids):
+        i = bisect_left(key.question_ids, question_id)
+        if i < len(key.question_ids) and key.question_ids[i] == question_id:
+            positions.append(i)
+    return AnswerKey(
+        question_ids=tuple(key.question_ids[i] for i in positions),
+        fields=tuple(key.fields[i] for i in positions),
+        answers=''.join(key.answers[i] for i in positions)
+    )
+
+
+def grade(key, form):
+    get = form.get
+    score = 0
+    for field, correct in zip(key.fields, key.answers):
+        if get(field) == correct:
+            score += 1
+    return score
@@ -0,0 +1,45 @@
+import gc
+import os
+
+# Read by gunicorn when started from this directory:
+#
+#     flask migrate-db && gunicorn -w 4 app:app
+#
+# The master builds the app once and forks the workers from it
+# (GUNICORN_PRELOAD = "0" turns that off), so they start at once and share
+# its memory copy-on-write. Before forking it does the one-off setup every
+# worker would otherwise repeat on its first request, and moves everything
+# allocated so far out of the garbage collector's reach, so collections in
+# the workers do not write to (and so copy) the shared pages. Building the
+# app does not connect to the database; if anything in the master did, the
+# workers drop the inherited connections instead of sharing them.
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        from sqlalchemy.orm import configure_mappers
+        from app import app
+
+        configure_mappers()
+        app.url_map.update()
+        for name in app.jinja_env.list_templates():
+            try:
+                app.jinja_env.get_template(name)
+            except Exception as exc:
+                # Left to fail when (and if) something renders it
+                server.log.warning('Template %s not precompiled: %s', name, exc)
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from app import app, db
+
+        with app.app_context():
+            engines = list(db.engines.values())
+        if 'sqlite_reader' in app.extensions:
+            engines.append(app.extensions['sqlite_reader'])
+        for engine in engines:
+            engine.dispose(close=False)
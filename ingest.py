@@ -0,0 +1,249 @@
+import atexit
+import fcntl
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import insert
+from app import db
+from models import QuizAttempt
+import rollups
+import leaderboards
+import workers
+
+# Graded attempts are written either synchronously, one transaction per
+# submission (ATTEMPT_INGEST = "sync", the default), or handed to a per-worker
+# queue that a background thread drains into multi-row INSERTs
+# (ATTEMPT_INGEST = "batched"). A batch is flushed once it holds
+# ATTEMPT_BATCH_SIZE attempts or ATTEMPT_BATCH_WINDOW seconds have passed.
+#
+# Queued attempts live only in memory unless ATTEMPT_JOURNAL_DIR is set. Then
+# every accepted attempt is first appended (and fsynced) to a journal segment
+# owned by this worker, and segments left behind by a crashed worker are
+# replayed on the next start. Replay is at-least-once: a crash between a
+# batch's commit and the removal of its segment replays that batch.
+#
+# Attempts at a quiz deleted while they were queued are left out of their
+# batch when it is written. A batch that still fails is written one attempt
+# at a time, so a bad attempt does not take the rest with it. Attempts left
+# out or still failing are logged and, with a journal, set aside in a
+# rejected-*.jsonl file there. Those are not replayed by themselves
+# (renamed to attempts-*.jsonl, they are on the next start), so a database
+# outage that rejects a whole batch loses nothing either.
+#
+# The student sees their score straight away either way: it is computed
+# before the attempt is handed over, and flashed by submit_quiz.
+
+# question_ids is None when the attempt had all of the quiz's questions
+PendingAttempt = namedtuple('PendingAttempt',
+                            'user_id quiz_id chapter_id score question_count completed_at question_ids',
+                            defaults=(None,))
+
+MAX_FLUSH_RETRIES = 3
+
+
+def _write(attempts):
+    # Returns the attempts left out because their quiz has been deleted
+    # since they were graded
+    subjects = rollups.quiz_subjects({attempt.quiz_id for attempt in attempts})
+    dropped = [attempt for attempt in attempts if attempt.quiz_id not in subjects]
+    attempts = [attempt for attempt in attempts if attempt.quiz_id in subjects]
+    if attempts:
+        db.session.execute(insert(QuizAttempt), [
+            {
+                'user_id': attempt.user_id,
+                'quiz_id': attempt.quiz_id,
+                'score': attempt.score,
+                'question_count': attempt.question_count,
+                'question_ids': attempt.question_ids,
+                'completed_at': attempt.completed_at
+            }
+            for attempt in attempts
+        ])
+        rollups.record_attempts(attempts, subjects)
+        leaderboards.record_attempts(attempts, subjects)
+    return dropped
+
+
+def _encode(attempt):
+    return json.dumps(attempt._replace(completed_at=attempt.completed_at.isoformat())._asdict())
+
+
+def _decode(line):
+    fields = json.loads(line)
+    fields['completed_at'] = datetime.fromisoformat(fields['completed_at'])
+    return PendingAttempt(**fields)
+
+
+class _Journal:
+    def __init__(self, directory):
+        self.directory = directory
+        self.sequence = 0
+        os.makedirs(directory, exist_ok=True)
+        self.segment = self._open()
+
+    def _open(self):
+        self.sequence += 1
+        path = os.path.join(self.directory, f'attempts-{os.getpid()}-{time.time_ns()}-{self.sequence}.jsonl')
+        handle = open(path, 'a')
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def append(self, attempt):
+        self.segment.write(_encode(attempt) + '\n')
+        self.segment.flush()
+        os.fsync(self.segment.fileno())
+
+    def rotate(self):
+        retired, self.segment = self.segment, self._open()
+        return retired
+
+    def reject(self, attempts):
+        path = os.path.join(self.directory, f'rejected-{os.getpid()}-{time.time_ns()}.jsonl')
+        with open(path, 'w') as handle:
+            handle.writelines(_encode(attempt) + '\n' for attempt in attempts)
+            handle.flush()
+            os.fsync(handle.fileno())
+
+    @staticmethod
+    def discard(segment):
+        os.unlink(segment.name)
+        segment.close()
+
+    def orphaned_segments(self):
+        # Segments nobody holds a lock on belong to workers that are gone
+        for path in sorted(glob.glob(os.path.join(self.directory, 'attempts-*.jsonl'))):
+            handle = open(path)
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                handle.close()
+                continue
+            yield handle
+
+
+class AttemptIngestor:
+    def __init__(self, app):
+        self.app = app
+        self.batch_size = app.config['ATTEMPT_BATCH_SIZE']
+        self.window = app.config['ATTEMPT_BATCH_WINDOW']
+        self.queue = queue.Queue(maxsize=app.config['ATTEMPT_QUEUE_SIZE'])
+        self.lock = threading.Lock()
+        self.journal = None
+        if app.config.get('ATTEMPT_JOURNAL_DIR'):
+            self.journal = _Journal(app.config['ATTEMPT_JOURNAL_DIR'])
+            self._replay_orphans()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='attempt-ingestor', daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def offer(self, attempt):
+        # Returns False when the queue is full; the caller then writes the
+        # attempt synchronously instead
+        with self.lock:
+            if self.queue.full():
+                return False
+            if self.journal:
+                self.journal.append(attempt)
+            self.queue.put_nowait(attempt)
+        return True
+
+    def _drain(self):
+        batch = []
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        if not batch:
+            return batch, None
+        with self.lock:
+            # Everything still queued goes into this batch too, so the
+            # retired journal segment matches the batch exactly
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            segment = self.journal.rotate() if self.journal else None
+        return batch, segment
+
+    def _commit(self, attempts, failure, *args):
+        # Returns whether the attempts were written; logs failure otherwise
+        with self.app.app_context():
+            try:
+                dropped = _write(attempts)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception(failure, *args)
+                return False
+            finally:
+                db.session.remove()
+        if dropped:
+            _log_dropped(self.app.logger, dropped)
+            if self.journal:
+                self.journal.reject(dropped)
+        return True
+
+    def _flush(self, batch, segment):
+        for try_number in range(1, MAX_FLUSH_RETRIES + 1):
+            if self._commit(batch, 'Flushing %d attempts failed (try %d of %d)',
+                            len(batch), try_number, MAX_FLUSH_RETRIES):
+                break
+            time.sleep(self.window * try_number)
+        else:
+            rejected = [attempt for attempt in batch
+                        if not self._commit([attempt], 'Writing attempt %s failed', _encode(attempt))]
+            if rejected and self.journal:
+                self.journal.reject(rejected)
+        if segment:
+            self.journal.discard(segment)
+
+    def _run(self):
+        while not self.stopping.is_set() or not self.queue.empty():
+            batch, segment = self._drain()
+            if batch:
+                self._flush(batch, segment)
+
+    def _replay_orphans(self):
+        for segment in self.journal.orphaned_segments():
+            batch = [_decode(line) for line in segment if line.strip()]
+            if batch:
+                self.app.logger.info('Replaying %d journaled attempts from %s', len(batch), segment.name)
+                self._flush(batch, segment)
+            else:
+                self.journal.discard(segment)
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        if self.journal:
+            # Everything accepted has been flushed by now
+            self.journal.discard(self.journal.segment)
+
+
+_get_ingestor = workers.per_process(lambda: AttemptIngestor(current_app._get_current_object()))
+
+
+def _log_dropped(logger, attempts):
+    for attempt in attempts:
+        logger.warning('Attempt %s dropped: its quiz has been deleted', _encode(attempt))
+
+
+def submit(attempt):
+    if current_app.config['ATTEMPT_INGEST'] == 'batched' and _get_ingestor().offer(attempt):
+        return
+    dropped = _write([attempt])
+    db.session.commit()
+    _log_dropped(current_app.logger, dropped)
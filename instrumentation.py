@@ -0,0 +1,240 @@
+import bisect
+import itertools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import workers
+
+# Per-request instrumentation, all opt-in:
+#
+# - QUERY_COUNTER (or debug mode): X-Query-Count header and a log line.
+# - METRICS: per-endpoint histograms of wall time, SQL statement count, SQL
+#   time and template render time for every blueprint endpoint, served in
+#   Prometheus text format on /admin/metrics. With METRICS_ALLOCATIONS also
+#   the peak memory allocated while handling the request, via tracemalloc
+#   (which slows every allocation down, and whose peak is process-wide, so
+#   concurrent requests in threaded workers inflate each other's figure).
+# - PROFILE_SLOW_REQUESTS = <seconds>: a sampling profiler takes the stack of
+#   every in-flight request each PROFILE_INTERVAL seconds, and requests that
+#   take longer than the threshold are written to PROFILE_DIR as collapsed
+#   stacks, ready for flamegraph.pl or speedscope.
+#
+# Histograms are kept per worker process; scrape each worker, or run a single
+# worker while measuring.
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+BYTE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2)
+
+METRIC_PREFIX = 'quizmaster_'
+METRICS = {
+    'request_duration_seconds': ('Wall time per request.', TIME_BUCKETS),
+    'sql_queries': ('SQL statements executed per request.', COUNT_BUCKETS),
+    'sql_duration_seconds': ('Time spent executing SQL per request.', TIME_BUCKETS),
+    'template_duration_seconds': ('Template render time per request, including queries run from templates.',
+                                  TIME_BUCKETS),
+    'peak_allocated_bytes': ('Peak memory allocated while handling the request.', BYTE_BUCKETS),
+}
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _time_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if started and has_request_context():
+        g.sql_time = g.get('sql_time', 0.0) + time.perf_counter() - started.pop()
+
+
+@event.listens_for(Engine, 'handle_error')
+def _discard_query_timer(context):
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def observe(metric, endpoint, value):
+    with _histograms_lock:
+        histogram = _histograms.get((metric, endpoint))
+        if histogram is None:
+            histogram = _histograms[(metric, endpoint)] = Histogram(METRICS[metric][1])
+        histogram.observe(value)
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics():
+    """All histograms in the Prometheus text exposition format."""
+    with _histograms_lock:
+        snapshot = {key: (histogram.buckets, list(histogram.counts), histogram.sum)
+                    for key, histogram in _histograms.items()}
+    lines = []
+    for metric, (description, _) in METRICS.items():
+        series = sorted((endpoint, values) for (name, endpoint), values in snapshot.items() if name == metric)
+        if not series:
+            continue
+        name = METRIC_PREFIX + metric
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} histogram')
+        for endpoint, (buckets, counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{_number(bound)}"}} {cumulative}')
+            lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {_number(total)}')
+            lines.append(f'{name}_count{{endpoint="{endpoint}"}} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def _fold(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+class SlowRequestProfiler:
+    def __init__(self, app):
+        self.app = app
+        self.threshold = app.config['PROFILE_SLOW_REQUESTS']
+        self.interval = app.config['PROFILE_INTERVAL']
+        self.directory = app.config['PROFILE_DIR']
+        os.makedirs(self.directory, exist_ok=True)
+        # Thread id -> Counter of folded stacks, for requests in flight
+        self.samples = {}
+        self.lock = threading.Lock()
+        self.sequence = itertools.count(1)
+        self.thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+        self.thread.start()
+
+    def watch(self):
+        with self.lock:
+            self.samples[threading.get_ident()] = Counter()
+
+    def release(self, endpoint, duration):
+        with self.lock:
+            samples = self.samples.pop(threading.get_ident(), None)
+        if samples and duration >= self.threshold:
+            self._dump(endpoint, duration, samples)
+
+    def _dump(self, endpoint, duration, samples):
+        # The pid and this profiler's own sequence number keep names unique
+        # across workers and within the second; "x" refuses to overwrite
+        path = os.path.join(self.directory, f'{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}-'
+                                            f'{next(self.sequence)}-{endpoint}-{int(duration * 1000)}ms.folded')
+        with open(path, 'x') as handle:
+            for stack, count in samples.most_common():
+                handle.write(f'{stack} {count}\n')
+        self.app.logger.warning('%s took %.3fs; profile written to %s', endpoint, duration, path)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.samples:
+                    continue
+                frames = sys._current_frames()
+                for ident, samples in self.samples.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[_fold(frame)] += 1
+
+
+_get_profiler = workers.per_process(SlowRequestProfiler)
+
+
+def init_app(app):
+    # Reports queries per request in debug mode (or with QUERY_COUNTER set),
+    # as a log line and an X-Query-Count response header
+    @app.after_request
+    def report_query_count(response):
+        if app.debug or app.config.get('QUERY_COUNTER'):
+            count = g.get('query_count', 0)
+            response.headers['X-Query-Count'] = str(count)
+            app.logger.debug('%s %s ran %d queries', request.method, request.path, count)
+        return response
+
+    metrics = app.config.get('METRICS')
+    allocations = metrics and app.config.get('METRICS_ALLOCATIONS')
+    profiling = bool(app.config.get('PROFILE_SLOW_REQUESTS'))
+    if not metrics and not profiling:
+        return
+    if allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    def _instrumented():
+        # Blueprint endpoints only; static files and unmatched URLs are skipped
+        return request.endpoint is not None and '.' in request.endpoint
+
+    @app.before_request
+    def start_request_timer():
+        if not _instrumented():
+            return
+        g.request_started = time.perf_counter()
+        if allocations:
+            tracemalloc.reset_peak()
+            g.memory_at_start = tracemalloc.get_traced_memory()[0]
+        if profiling:
+            _get_profiler(app).watch()
+
+    def start_template_timer(sender, template, context, **extra):
+        if has_request_context():
+            g.template_started = time.perf_counter()
+
+    def stop_template_timer(sender, template, context, **extra):
+        if has_request_context() and 'template_started' in g:
+            g.template_time = g.get('template_time', 0.0) + time.perf_counter() - g.pop('template_started')
+
+    before_render_template.connect(start_template_timer, app, weak=False)
+    template_rendered.connect(stop_template_timer, app, weak=False)
+
+    # Teardown runs after a streamed response has been sent in full, so
+    # exports are timed end to end
+    @app.teardown_request
+    def record_request(exc):
+        started = g.pop('request_started', None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        endpoint = request.endpoint
+        if profiling:
+            _get_profiler(app).release(endpoint, duration)
+        if not metrics:
+            return
+        observe('request_duration_seconds', endpoint, duration)
+        observe('sql_queries', endpoint, g.get('query_count', 0))
+        observe('sql_duration_seconds', endpoint, g.get('sql_time', 0.0))
+        observe('template_duration_seconds', endpoint, g.get('template_time', 0.0))
+        if allocations:
+            observe('peak_allocated_bytes', endpoint,
+                    max(0, tracemalloc.get_traced_memory()[1] - g.pop('memory_at_start')))
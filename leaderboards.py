@@ -0,0 +1,328 @@
+import threading
+from datetime import datetime
+from bisect import bisect_left, insort
+from collections import OrderedDict, defaultdict, namedtuple
+from itertools import groupby
+from operator import itemgetter
+from sqlalchemy import select, update, delete, insert, func
+from app import db
+from models import Chapter, Quiz, QuizAttempt, Leaderboard, LeaderboardEntry
+import upserts
+
+# Rankings per quiz, per subject and overall. A student's points on a quiz
+# board are their best score there, in thousandths of the quiz (1000 is full
+# marks); on a subject board and the global board they are the sum of their
+# quiz points, so retaking a quiz only counts when it beats the old best.
+# Equal points are ranked by who reached them first.
+#
+# The database holds the boards (LeaderboardEntry), updated in the same
+# transaction as the attempts. Each worker keeps its own sorted copy of the
+# boards it has served recently, and before answering checks the board's
+# version: one primary-key read, plus a read of only the entries changed
+# since, when it is behind. Top-N and rank lookups on the sorted copy are
+# binary searches.
+#
+# Board rows are created with their quiz (quiz_added). Entries are upserted
+# (INSERT ... ON CONFLICT), so two transactions adding the same student
+# never collide. A transaction locks every board it will change before
+# changing any entry, global first, then subjects, then quizzes, so
+# concurrent transactions never wait on each other in a cycle.
+
+POINTS_PER_QUIZ = 1000
+MAX_CACHED_BOARDS = 256
+REBUILD_CHUNK_SIZE = 10000
+GLOBAL = 'global'
+
+Ranking = namedtuple('Ranking', 'rank user_id points')
+
+
+def quiz_board(quiz_id):
+    return f'quiz:{quiz_id}'
+
+
+def subject_board(subject_id):
+    return f'subject:{subject_id}'
+
+
+def _create_boards(boards):
+    db.session.execute(upserts.insert(Leaderboard).on_conflict_do_nothing(),
+                       [{'board': board, 'version': 0} for board in boards])
+
+
+def quiz_added(quiz):
+    subject_id = db.session.get(Chapter, quiz.chapter_id).subject_id
+    _create_boards([GLOBAL, subject_board(subject_id), quiz_board(quiz.id)])
+
+
+def _lock_order(board):
+    return board != GLOBAL, not board.startswith('subject:'), board
+
+
+def _lock_boards(boards):
+    """Bump every board's version, in lock order; returns {board: new version}.
+
+    The UPDATE locks the board's row until commit, so versions are committed
+    in the order they are handed out.
+    """
+    versions = {}
+    for board in sorted(boards, key=_lock_order):
+        bumped = update(Leaderboard).where(Leaderboard.board == board)\
+            .values(version=Leaderboard.version + 1)\
+            .returning(Leaderboard.version)\
+            .execution_options(synchronize_session=False)
+        version = db.session.execute(bumped).scalar()
+        if version is None:
+            # A board from before boards were created with their quiz
+            _create_boards([board])
+            version = db.session.execute(bumped).scalar()
+        versions[board] = version
+    return versions
+
+
+def _add_points(board, version, changes):
+    # changes: {user_id: (points delta, achieved_at)}; an achieved_at of
+    # None leaves the entry's own in place
+    now = datetime.utcnow()
+    for keep_achieved_at in (False, True):
+        rows = [{'board': board, 'user_id': user_id, 'points': delta,
+                 'achieved_at': achieved_at or now, 'version': version}
+                for user_id, (delta, achieved_at) in changes.items()
+                if (achieved_at is None) == keep_achieved_at]
+        if not rows:
+            continue
+        stmt = upserts.insert(LeaderboardEntry)
+        values = {'points': LeaderboardEntry.points + stmt.excluded.points, 'version': stmt.excluded.version}
+        if not keep_achieved_at:
+            values['achieved_at'] = stmt.excluded.achieved_at
+        db.session.execute(stmt.on_conflict_do_update(index_elements=['board', 'user_id'], set_=values), rows)
+
+
+def _improvements(best, subjects):
+    # {board: {user_id: (points delta, achieved_at)}} for the attempts in
+    # best that beat the student's best score at their quiz
+    boards = defaultdict(dict)
+    for (user_id, quiz_id), (points, achieved_at) in best.items():
+        if quiz_id not in subjects:
+            # Deleted, with its boards, while the attempt was queued
+            continue
+        board = quiz_board(quiz_id)
+        previous = db.session.execute(
+            select(LeaderboardEntry.points)
+            .where(LeaderboardEntry.board == board, LeaderboardEntry.user_id == user_id)
+        ).scalar()
+        if previous is not None and previous >= points:
+            continue
+        delta = points - (previous or 0)
+        for changed in (board, subject_board(subjects[quiz_id]), GLOBAL):
+            total, _ = boards[changed].get(user_id, (0, None))
+            boards[changed][user_id] = (total + delta, achieved_at)
+    return boards
+
+
+def record_attempts(attempts, subjects):
+    # Attempts carry user_id, quiz_id, chapter_id, score, question_count and
+    # completed_at, and subjects maps their quizzes to subject ids, as for
+    # rollups.record_attempts
+    best = {}
+    for attempt in attempts:
+        if not attempt.question_count:
+            continue
+        points = round(attempt.score * POINTS_PER_QUIZ / attempt.question_count)
+        key = (attempt.user_id, attempt.quiz_id)
+        if key not in best or points > best[key][0]:
+            best[key] = (points, attempt.completed_at)
+
+    boards = _improvements(best, subjects)
+    if not boards:
+        return
+    versions = _lock_boards(boards)
+    # Again under the locks: a concurrent transaction may have raised some
+    # of these best scores in the meantime
+    for board, changes in _improvements(best, subjects).items():
+        _add_points(board, versions[board], changes)
+
+
+def quizzes_deleted(quiz_ids):
+    # Take the quizzes' points back off the subject and global boards, then
+    # drop the quiz boards themselves. Students left without points stay on
+    # those boards with 0, as after a zero score
+    if not quiz_ids:
+        return
+    boards = {quiz_board(quiz_id): quiz_id for quiz_id in quiz_ids}
+    subjects = dict(db.session.query(Quiz.id, Chapter.subject_id)
+                    .join(Chapter, Quiz.chapter_id == Chapter.id)
+                    .filter(Quiz.id.in_(quiz_ids)))
+    changes = defaultdict(dict)
+    entries = db.session.query(LeaderboardEntry.board, LeaderboardEntry.user_id, LeaderboardEntry.points)\
+        .filter(LeaderboardEntry.board.in_(boards))
+    for board, user_id, points in entries:
+        for changed in (subject_board(subjects[boards[board]]), GLOBAL):
+            delta, _ = changes[changed].get(user_id, (0, None))
+            changes[changed][user_id] = (delta - points, None)
+    versions = _lock_boards(changes)
+    for board, board_changes in changes.items():
+        _add_points(board, versions[board], board_changes)
+    db.session.execute(delete(LeaderboardEntry).where(LeaderboardEntry.board.in_(boards)))
+    db.session.execute(delete(Leaderboard).where(Leaderboard.board.in_(boards)))
+
+
+def subject_deleted(subject):
+    quizzes_deleted([quiz.id for chapter in subject.chapters for quiz in chapter.quizzes])
+    board = subject_board(subject.id)
+    db.session.execute(delete(LeaderboardEntry).where(LeaderboardEntry.board == board))
+    db.session.execute(delete(Leaderboard).where(Leaderboard.board == board))
+
+
+def _rebuilt_entries(version):
+    # Points are scored against each attempt's own question count, so the
+    # best is picked here, as record_attempts does, from when each score out
+    # of each count was first reached. Rows come one student at a time, so
+    # only that student's subject and global totals are held in memory.
+    rows = db.session.query(
+        QuizAttempt.user_id, QuizAttempt.quiz_id, Chapter.subject_id,
+        QuizAttempt.score, QuizAttempt.question_count, func.min(QuizAttempt.completed_at)
+    ).join(Quiz, Quiz.id == QuizAttempt.quiz_id)\
+    .join(Chapter, Quiz.chapter_id == Chapter.id)\
+    .filter(QuizAttempt.question_count > 0)\
+    .group_by(QuizAttempt.user_id, QuizAttempt.quiz_id, Chapter.subject_id,
+              QuizAttempt.score, QuizAttempt.question_count)\
+    .order_by(QuizAttempt.user_id, QuizAttempt.quiz_id)\
+    .yield_per(REBUILD_CHUNK_SIZE)
+
+    for user_id, user_rows in groupby(rows, key=itemgetter(0)):
+        totals = {}
+        for quiz_id, quiz_rows in groupby(user_rows, key=itemgetter(1)):
+            best = None
+            for _, _, subject_id, score, question_count, achieved_at in quiz_rows:
+                points = round(score * POINTS_PER_QUIZ / question_count)
+                if best is None or points > best[0] or (points == best[0] and achieved_at < best[1]):
+                    best = (points, achieved_at, subject_id)
+            points, achieved_at, subject_id = best
+            yield {'board': quiz_board(quiz_id), 'user_id': user_id, 'points': points,
+                   'achieved_at': achieved_at, 'version': version}
+            for board in (subject_board(subject_id), GLOBAL):
+                total = totals.setdefault(board, [0, achieved_at])
+                total[0] += points
+                total[1] = max(total[1], achieved_at)
+        for board, (points, achieved_at) in totals.items():
+            yield {'board': board, 'user_id': user_id, 'points': points,
+                   'achieved_at': achieved_at, 'version': version}
+
+
+def rebuild():
+    """Recompute every board from the attempts; run after rollups.rebuild().
+
+    Versions carry on from the old boards, so running workers catch up, but
+    they only drop entries the rebuild removed once restarted."""
+    version = (db.session.execute(select(func.max(Leaderboard.version))).scalar() or 0) + 1
+    db.session.execute(delete(LeaderboardEntry))
+    db.session.execute(delete(Leaderboard))
+
+    # Written REBUILD_CHUNK_SIZE entries at a time, however many there are
+    count = 0
+    chunk = []
+    for entry in _rebuilt_entries(version):
+        chunk.append(entry)
+        if len(chunk) == REBUILD_CHUNK_SIZE:
+            db.session.execute(insert(LeaderboardEntry), chunk)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(insert(LeaderboardEntry), chunk)
+        count += len(chunk)
+
+    # Every quiz gets its boards, as from quiz_added; every board with
+    # entries is one of them
+    boards = {GLOBAL}
+    quizzes = db.session.query(Quiz.id, Chapter.subject_id).join(Chapter, Quiz.chapter_id == Chapter.id)
+    for quiz_id, subject_id in quizzes:
+        boards.update((quiz_board(quiz_id), subject_board(subject_id)))
+    db.session.execute(insert(Leaderboard), [{'board': board, 'version': version} for board in boards])
+    return count
+
+
+class _SortedBoard:
+    # Keys sort best first: (-points, achieved_at, user_id)
+    def __init__(self, version):
+        self.version = version
+        self.keys = []
+        self.by_user = {}
+
+    def apply(self, rows):
+        if not self.by_user:
+            # First load: one sort, rather than an insort per entry
+            self.by_user = {user_id: (-points, achieved_at, user_id) for user_id, points, achieved_at in rows}
+            self.keys = sorted(self.by_user.values())
+            return
+        for user_id, points, achieved_at in rows:
+            old = self.by_user.get(user_id)
+            if old is not None:
+                del self.keys[bisect_left(self.keys, old)]
+            key = (-points, achieved_at, user_id)
+            insort(self.keys, key)
+            self.by_user[user_id] = key
+
+
+_boards = OrderedDict()
+_boards_lock = threading.Lock()
+
+
+def _synced(board):
+    """This worker's copy of `board`, brought up to date; None if empty."""
+    version = db.session.execute(select(Leaderboard.version).where(Leaderboard.board == board)).scalar()
+    with _boards_lock:
+        if version is None:
+            _boards.pop(board, None)
+            return None
+        cached = _boards.get(board)
+        if cached is not None and cached.version >= version:
+            _boards.move_to_end(board)
+            return cached
+        since = cached.version if cached is not None else None
+
+    query = select(LeaderboardEntry.user_id, LeaderboardEntry.points, LeaderboardEntry.achieved_at,
+                   LeaderboardEntry.version).where(LeaderboardEntry.board == board)
+    if since is not None:
+        query = query.where(LeaderboardEntry.version > since)
+    rows = db.session.execute(query).all()
+
+    with _boards_lock:
+        cached = _boards.get(board)
+        if since is None:
+            cached = _boards[board] = _SortedBoard(0)
+        elif cached is None:
+            # Evicted meanwhile, and the changed entries alone cannot rebuild it
+            cached = _boards[board] = _SortedBoard(0)
+            rows = None
+        if rows is not None:
+            # Another thread may have caught up further in the meantime;
+            # entries it already holds are not rolled back
+            cached.apply((user_id, points, achieved_at) for user_id, points, achieved_at, changed in rows
+                         if changed > cached.version)
+            cached.version = max(cached.version, version)
+        _boards.move_to_end(board)
+        while len(_boards) > MAX_CACHED_BOARDS:
+            _boards.popitem(last=False)
+    return cached if rows is not None else _synced(board)
+
+
+def top(board, limit=10):
+    cached = _synced(board)
+    if cached is None:
+        return []
+    with _boards_lock:
+        keys = cached.keys[:limit]
+    return [Ranking(rank, user_id, -points) for rank, (points, _, user_id) in enumerate(keys, start=1)]
+
+
+def rank(board, user_id):
+    """Returns (Ranking, board size), or (None, board size) if the user is not on it."""
+    cached = _synced(board)
+    if cached is None:
+        return None, 0
+    with _boards_lock:
+        key = cached.by_user.get(user_id)
+        size = len(cached.keys)
+        if key is None:
+            return None, size
+        return Ranking(bisect_left(cached.keys, key) + 1, user_id, -key[0]), size
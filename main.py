@@ -1,4 +1,9 @@
 from app import app
+import migrations
 
 if __name__ == "__main__":
+    # The development server brings its database up to date itself; deployments
+    # run `flask migrate-db` before starting the workers
+    with app.app_context():
+        migrations.upgrade()
     app.run(host="0.0.0.0", port=5000, debug=True)
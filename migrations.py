@@ -0,0 +1,115 @@
+from sqlalchemy import inspect, select, text, update
+from app import db
+from models import SchemaVersion
+
+# Schema management, run explicitly with `flask migrate-db` (never at
+# startup). upgrade() has db.create_all() create any missing tables at the
+# latest schema, then applies the ordered migrations below. create_all() only
+# creates missing tables, so anything that changes a table that may already
+# exist (new indexes, new columns) goes here as a numbered step. Steps must be
+# safe to run against a database created fresh by create_all(), which already
+# has the latest schema, and must spell out their DDL rather than read it from
+# the current models.
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(fn):
+        assert not MIGRATIONS or MIGRATIONS[-1][0] < version, 'migrations must be numbered in order'
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+
+def _create_index(connection, name, table, columns):
+    connection.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})'))
+
+
+def _drop_index(connection, name):
+    connection.execute(text(f'DROP INDEX IF EXISTS {name}'))
+
+
+def _add_column(connection, table, column, definition):
+    # SQLite has no ADD COLUMN IF NOT EXISTS
+    if column not in {c['name'] for c in inspect(connection).get_columns(table)}:
+        connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {definition}'))
+
+
+@migration(1, 'indexes for hot query shapes')
+def add_hot_query_indexes(connection):
+    _create_index(connection, 'ix_chapter_subject_id', 'chapter', 'subject_id')
+    _create_index(connection, 'ix_quiz_chapter_id', 'quiz', 'chapter_id')
+    _create_index(connection, 'ix_quiz_schedule', 'quiz', 'start_date, end_date')
+    _create_index(connection, 'ix_question_quiz_id', 'question', 'quiz_id')
+    _create_index(connection, 'ix_quiz_attempt_quiz_id', 'quiz_attempt', 'quiz_id')
+    _create_index(connection, 'ix_quiz_attempt_user_recent', 'quiz_attempt', 'user_id, completed_at DESC')
+    _create_index(connection, 'ix_quiz_stats_subject_id', 'quiz_stats', 'subject_id')
+
+
+@migration(2, 'keyset pagination indexes on attempts')
+def add_attempt_history_indexes(connection):
+    # (completed_at, id) is the pagination key; the new indexes also cover
+    # every lookup the two they replace were serving
+    _create_index(connection, 'ix_quiz_attempt_user_history', 'quiz_attempt', 'user_id, completed_at, id')
+    _create_index(connection, 'ix_quiz_attempt_quiz_history', 'quiz_attempt', 'quiz_id, completed_at, id')
+    _drop_index(connection, 'ix_quiz_attempt_user_recent')
+    _drop_index(connection, 'ix_quiz_attempt_quiz_id')
+
+
+@migration(3, 'questions drawn per attempt')
+def add_quiz_sample_size(connection):
+    _add_column(connection, 'quiz', 'sample_size', 'INTEGER')
+
+
+@migration(4, 'question count and drawn questions stored per attempt')
+def add_attempt_question_count(connection):
+    _add_column(connection, 'quiz_attempt', 'question_count', 'INTEGER NOT NULL DEFAULT 0')
+    _add_column(connection, 'quiz_attempt', 'question_ids', 'JSON')
+    _add_column(connection, 'quiz_stats', 'graded_attempt_count', 'INTEGER NOT NULL DEFAULT 0')
+    _add_column(connection, 'quiz_stats', 'percent_sum', 'FLOAT NOT NULL DEFAULT 0')
+    # Earlier attempts were not recorded with theirs; the quiz's count as
+    # it stands is the best there is, and what they were scored against so far
+    connection.execute(text(
+        'UPDATE quiz_attempt SET question_count = '
+        '(SELECT question_count FROM quiz_stats WHERE quiz_stats.quiz_id = quiz_attempt.quiz_id) '
+        'WHERE question_count = 0 '
+        'AND EXISTS (SELECT 1 FROM quiz_stats WHERE quiz_stats.quiz_id = quiz_attempt.quiz_id)'
+    ))
+    connection.execute(text(
+        'UPDATE quiz_stats SET graded_attempt_count = attempt_count, '
+        'percent_sum = 100.0 * score_sum / question_count '
+        'WHERE question_count > 0'
+    ))
+
+
+def current_version():
+    with db.engine.connect() as connection:
+        if not inspect(connection).has_table(SchemaVersion.__tablename__):
+            return 0
+        return connection.execute(
+            select(SchemaVersion.version).where(SchemaVersion.id == 1)
+        ).scalar() or 0
+
+
+def missing_tables():
+    existing = set(inspect(db.engine).get_table_names())
+    return [table.name for table in db.metadata.sorted_tables if table.name not in existing]
+
+
+def pending():
+    version = current_version()
+    return [step for step in MIGRATIONS if step[0] > version]
+
+
+def upgrade():
+    db.create_all()
+    applied = []
+    for version, description, fn in pending():
+        # Each step commits together with the version bump, or not at all
+        with db.engine.begin() as connection:
+            fn(connection)
+            stmt = update(SchemaVersion).where(SchemaVersion.id == 1).values(version=version)
+            if connection.execute(stmt).rowcount == 0:
+                connection.execute(SchemaVersion.__table__.insert().values(id=1, version=version))
+        applied.append((version, description))
+    return applied
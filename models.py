@@ -1,11 +1,7 @@
 from datetime import datetime
-from app import db, login_manager
+from app import db
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-
-@login_manager.user_loader
-def load_user(id):
-    return User.query.get(int(id))
+import passwords
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -16,10 +12,10 @@ class User(UserMixin, db.Model):
     quiz_attempts = db.relationship('QuizAttempt', backref='user', lazy=True, cascade='all, delete-orphan')
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = passwords.hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return passwords.verify(self.password_hash, password)
 
 class Subject(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -29,14 +25,20 @@ class Subject(db.Model):
 class Chapter(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False, index=True)
     quizzes = db.relationship('Quiz', backref='chapter', lazy=True, cascade='all, delete-orphan')
 
 class Quiz(db.Model):
+    __table_args__ = (
+        db.Index('ix_quiz_schedule', 'start_date', 'end_date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
-    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'), nullable=False)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'), nullable=False, index=True)
     duration = db.Column(db.Integer)  # Duration in minutes
+    # Questions drawn at random from the quiz's questions for each attempt;
+    # None means every attempt gets all of them
+    sample_size = db.Column(db.Integer)
     start_date = db.Column(db.DateTime, nullable=False)
     end_date = db.Column(db.DateTime, nullable=False)
     questions = db.relationship('Question', backref='quiz', lazy=True, cascade='all, delete-orphan')
@@ -44,7 +46,7 @@ class Quiz(db.Model):
 
 class Question(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False, index=True)
     question_text = db.Column(db.Text, nullable=False)
     option_a = db.Column(db.String(200), nullable=False)
     option_b = db.Column(db.String(200), nullable=False)
@@ -53,8 +55,83 @@ class Question(db.Model):
     correct_answer = db.Column(db.String(1), nullable=False)
 
 class QuizAttempt(db.Model):
+    __table_args__ = (
+        # Attempt history per user and per quiz, newest first, paginated
+        # on (completed_at, id)
+        db.Index('ix_quiz_attempt_user_history', 'user_id', 'completed_at', 'id'),
+        db.Index('ix_quiz_attempt_quiz_history', 'quiz_id', 'completed_at', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
     score = db.Column(db.Integer, nullable=False)
-    completed_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    # Out of question_count; question_ids are the questions drawn for the
+    # attempt, or None when it had all of the quiz's questions
+    question_count = db.Column(db.Integer, nullable=False, default=0)
+    question_ids = db.Column(db.JSON)
+    completed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Dashboard rollups, maintained by rollups.py alongside the rows they summarise
+class SubjectStats(db.Model):
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), primary_key=True)
+    quiz_count = db.Column(db.Integer, nullable=False, default=0)
+    question_count = db.Column(db.Integer, nullable=False, default=0)
+    attempt_count = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Integer, nullable=False, default=0)
+    # Attempts on quizzes that have questions, and the sum of their percentages
+    graded_attempt_count = db.Column(db.Integer, nullable=False, default=0)
+    percent_sum = db.Column(db.Float, nullable=False, default=0.0)
+
+class QuizStats(db.Model):
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), primary_key=True)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False, index=True)
+    question_count = db.Column(db.Integer, nullable=False, default=0)
+    attempt_count = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Integer, nullable=False, default=0)
+    # Attempts that had questions, and the sum of their percentages
+    graded_attempt_count = db.Column(db.Integer, nullable=False, default=0)
+    percent_sum = db.Column(db.Float, nullable=False, default=0.0)
+
+class DailyQuizStats(db.Model):
+    # Quizzes run for a single calendar day, so the quizzes active right now
+    # are exactly the ones scheduled for today
+    day = db.Column(db.Date, primary_key=True)
+    quiz_count = db.Column(db.Integer, nullable=False, default=0)
+
+class UserSubjectStats(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), primary_key=True)
+    attempt_count = db.Column(db.Integer, nullable=False, default=0)
+
+class UserMonthlyStats(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)  # First day of the month
+    attempt_count = db.Column(db.Integer, nullable=False, default=0)
+
+# Leaderboards, maintained by leaderboards.py. A board is 'global',
+# 'subject:<id>' or 'quiz:<id>'; its version is bumped by every change to its
+# entries, and each entry records the version that last changed it
+class Leaderboard(db.Model):
+    board = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class LeaderboardEntry(db.Model):
+    __table_args__ = (
+        # Entries changed since a given version, to bring a cached board up to date
+        db.Index('ix_leaderboard_entry_changes', 'board', 'version'),
+    )
+    board = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    points = db.Column(db.Integer, nullable=False, default=0)
+    achieved_at = db.Column(db.DateTime, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+
+class ContentVersion(db.Model):
+    # Single row, bumped by every admin write to the Subject/Chapter/Quiz catalog
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class SchemaVersion(db.Model):
+    # Single row recording the last migration in migrations.py applied here
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,36 @@
+from datetime import datetime
+from sqlalchemy import tuple_
+from models import QuizAttempt
+
+# Keyset pagination over attempts, newest first. A page is located by the
+# (completed_at, id) of the last row on the previous one, so every page is an
+# index range scan of the same cost however deep into the history it is.
+
+ATTEMPTS_PER_PAGE = 20
+
+
+def encode_cursor(completed_at, attempt_id):
+    return f'{completed_at.isoformat()}_{attempt_id}'
+
+
+def decode_cursor(cursor):
+    # Raises ValueError for anything that did not come from encode_cursor
+    completed_at, _, attempt_id = cursor.rpartition('_')
+    return datetime.fromisoformat(completed_at), int(attempt_id)
+
+
+def attempt_page(query, cursor=None, per_page=ATTEMPTS_PER_PAGE):
+    """Return (rows, next_cursor) for the page after `cursor`.
+
+    `query` must select QuizAttempt rows, or rows with `completed_at` and `id`
+    columns taken from QuizAttempt; next_cursor is None on the last page.
+    """
+    if cursor:
+        query = query.filter(tuple_(QuizAttempt.completed_at, QuizAttempt.id) < decode_cursor(cursor))
+    rows = query.order_by(QuizAttempt.completed_at.desc(), QuizAttempt.id.desc())\
+        .limit(per_page + 1)\
+        .all()
+    if len(rows) <= per_page:
+        return rows, None
+    rows = rows[:per_page]
+    return rows, encode_cursor(rows[-1].completed_at, rows[-1].id)
@@ -0,0 +1,73 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+import workers
+
+# Password hashes are deliberately slow to compute, and at the start of an
+# exam every student logs in at once. PASSWORD_HASH_METHOD sets the werkzeug
+# method and cost used for new hashes (e.g. "scrypt:16384:8:1" or
+# "pbkdf2:sha256:600000"); a stored hash made with a different one is
+# replaced the next time its owner logs in.
+#
+# Hashing runs on a per-worker pool of PASSWORD_HASH_THREADS threads (0 hashes
+# on the request thread). hashlib releases the GIL while it hashes, so the
+# pool caps how many cores logins take from a worker without serialising
+# them. At most PASSWORD_HASH_QUEUE more requests wait for a free thread, for
+# up to PASSWORD_HASH_TIMEOUT seconds; past that HashingBusy is raised, and
+# the login page asks the student to try again instead of queueing without
+# bound.
+
+
+class HashingBusy(Exception):
+    pass
+
+
+_method_prefixes = {}
+
+
+def _start_pool(threads, waiting):
+    if not threads:
+        return None
+    return (ThreadPoolExecutor(max_workers=threads, thread_name_prefix='password-hash'),
+            threading.BoundedSemaphore(threads + waiting))
+
+
+def _stop_pool(pool):
+    # Hashes already submitted still finish; new ones go to the new pool
+    pool[0].shutdown(wait=False)
+
+
+# A new pool is started when the configured sizes change
+_get_pool = workers.per_process(_start_pool, _stop_pool)
+
+
+def _run(function, *args):
+    pool = _get_pool(current_app.config['PASSWORD_HASH_THREADS'], current_app.config['PASSWORD_HASH_QUEUE'])
+    if pool is None:
+        return function(*args)
+    executor, slots = pool
+    if not slots.acquire(timeout=current_app.config['PASSWORD_HASH_TIMEOUT']):
+        raise HashingBusy()
+    try:
+        return executor.submit(function, *args).result()
+    finally:
+        slots.release()
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def verify(password_hash, password):
+    return _run(check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    # Compares the method and cost parameters stored before the first "$"
+    # with those of a hash made with the configured method
+    method = current_app.config['PASSWORD_HASH_METHOD']
+    prefix = _method_prefixes.get(method)
+    if prefix is None:
+        prefix = _method_prefixes[method] = generate_password_hash('', method).split('$', 1)[0]
+    return password_hash.split('$', 1)[0] != prefix
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select, text, tuple_
+from app import db
+from models import Chapter, Quiz, Question, QuizAttempt
+import timeseries
+
+# Representative shapes of the queries on the hot paths, each with the table
+# that must be reached through an index rather than a full scan, and whether
+# its ORDER BY must also come from the index rather than a sort.
+
+
+def hot_queries():
+    now = datetime.utcnow()
+    return {
+        'recent attempts': ('quiz_attempt', True, select(QuizAttempt)
+                            .where(QuizAttempt.user_id == 1)
+                            .order_by(QuizAttempt.completed_at.desc())
+                            .limit(5)),
+        'attempt history page': ('quiz_attempt', True, select(QuizAttempt)
+                                 .where(QuizAttempt.user_id == 1,
+                                        tuple_(QuizAttempt.completed_at, QuizAttempt.id) < (now, 1))
+                                 .order_by(QuizAttempt.completed_at.desc(), QuizAttempt.id.desc())
+                                 .limit(21)),
+        'quiz results page': ('quiz_attempt', True, select(QuizAttempt)
+                              .where(QuizAttempt.quiz_id == 1,
+                                     tuple_(QuizAttempt.completed_at, QuizAttempt.id) < (now, 1))
+                              .order_by(QuizAttempt.completed_at.desc(), QuizAttempt.id.desc())
+                              .limit(21)),
+        'answer key': ('question', False, select(Question.id, Question.correct_answer)
+                       .where(Question.quiz_id == 1)
+                       .order_by(Question.id)),
+        'active quizzes': ('quiz', False, select(Quiz.id)
+                           .where(Quiz.start_date <= now, Quiz.end_date >= now)),
+        'quizzes of a chapter': ('quiz', False, select(Quiz.id).where(Quiz.chapter_id == 1)),
+        'chapters of a subject': ('chapter', False, select(Chapter.id).where(Chapter.subject_id == 1)),
+        'quiz trend': ('quiz_attempt', False, timeseries.series_statement(
+            'day', now - timedelta(days=30), now, QuizAttempt.quiz_id == 1)),
+    }
+
+
+def _compile(statement):
+    return str(statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+
+
+def _sqlite_plan(connection, sql):
+    return [row[-1] for row in connection.execute(text('EXPLAIN QUERY PLAN ' + sql))]
+
+
+def _sqlite_scans(plan, table, forbid_sort):
+    return [step for step in plan
+            if (step.startswith(f'SCAN {table}') and 'INDEX' not in step)
+            or (forbid_sort and 'TEMP B-TREE' in step)]
+
+
+def _postgresql_plan(connection, sql):
+    # Small tables would make the planner pick a sequential scan on cost
+    # alone, so rule it out and see whether an index path exists at all
+    connection.execute(text('SET LOCAL enable_seqscan = off'))
+    return [row[0] for row in connection.execute(text('EXPLAIN ' + sql))]
+
+
+def _postgresql_scans(plan, table, forbid_sort):
+    return [step.strip() for step in plan
+            if f'Seq Scan on {table}' in step or (forbid_sort and 'Sort ' in step)]
+
+
+def check():
+    """Return {query name: offending plan steps} for every hot query that
+    would scan or sort its table instead of using an index."""
+    dialect = db.engine.dialect.name
+    explain, scans = {
+        'sqlite': (_sqlite_plan, _sqlite_scans),
+        'postgresql': (_postgresql_plan, _postgresql_scans),
+    }[dialect]
+    failures = {}
+    with db.engine.connect() as connection:
+        for name, (table, forbid_sort, statement) in hot_queries().items():
+            with connection.begin():
+                offending = scans(explain(connection, _compile(statement)), table, forbid_sort)
+            if offending:
+                failures[name] = offending
+    return failures
@@ -0,0 +1,104 @@
+import csv
+import io
+import json
+from collections import namedtuple
+from sqlalchemy import insert
+from app import db
+from models import Question
+
+# Bulk question-bank import. Rows are parsed and validated one at a time, and
+# valid ones are inserted in executemany batches of CHUNK_SIZE inside the
+# caller's transaction. Invalid rows are reported and skipped rather than
+# failing the whole file.
+#
+# CSV and NDJSON are read as a stream; a JSON array is loaded whole. Field
+# names match the question export, so an exported bank can be re-imported;
+# question_id and quiz_id columns are ignored.
+
+FORMATS = ('csv', 'json', 'ndjson')
+FIELDS = ('question_text', 'option_a', 'option_b', 'option_c', 'option_d', 'correct_answer')
+OPTION_MAX_LENGTH = Question.__table__.c.option_a.type.length
+ANSWERS = ('A', 'B', 'C', 'D')
+CHUNK_SIZE = 500
+
+ImportReport = namedtuple('ImportReport', 'imported errors')
+
+
+def format_for(filename):
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return extension if extension in FORMATS else None
+
+
+def _records(stream, fmt):
+    # Yields (row number, record or None, parse error or None)
+    if fmt == 'csv':
+        # Row 1 is the header
+        for number, record in enumerate(csv.DictReader(stream), start=2):
+            yield number, record, None
+    elif fmt == 'ndjson':
+        for number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line), None
+            except ValueError as e:
+                yield number, None, f'invalid JSON: {e}'
+    else:
+        try:
+            records = json.load(stream)
+        except ValueError as e:
+            yield 1, None, f'invalid JSON: {e}'
+            return
+        if not isinstance(records, list):
+            yield 1, None, 'expected a JSON array of questions'
+            return
+        for number, record in enumerate(records, start=1):
+            yield number, record, None
+
+
+def validate(record):
+    """Return (question values, None) or (None, error message)."""
+    if not isinstance(record, dict):
+        return None, 'expected an object with question fields'
+    values = {}
+    for field in FIELDS:
+        value = record.get(field)
+        value = '' if value is None else str(value).strip()
+        if not value:
+            return None, f'{field} is required'
+        values[field] = value
+    for field in ('option_a', 'option_b', 'option_c', 'option_d'):
+        if len(values[field]) > OPTION_MAX_LENGTH:
+            return None, f'{field} is longer than {OPTION_MAX_LENGTH} characters'
+    values['correct_answer'] = values['correct_answer'].upper()
+    if values['correct_answer'] not in ANSWERS:
+        return None, 'correct_answer must be one of A, B, C or D'
+    return values, None
+
+
+def import_questions(quiz_id, stream, fmt):
+    """Add the questions in `stream` (text) to the quiz; the caller commits."""
+    imported = 0
+    errors = []
+    chunk = []
+    for number, record, error in _records(stream, fmt):
+        if error is None:
+            values, error = validate(record)
+        if error is not None:
+            errors.append((number, error))
+            continue
+        values['quiz_id'] = quiz_id
+        chunk.append(values)
+        if len(chunk) == CHUNK_SIZE:
+            db.session.execute(insert(Question), chunk)
+            imported += len(chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(insert(Question), chunk)
+        imported += len(chunk)
+    return ImportReport(imported, errors)
+
+
+def text_stream(binary):
+    # Uploads and files opened in binary mode; utf-8-sig drops an Excel BOM
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
@@ -0,0 +1,76 @@
+from sqlalchemy import insert, update, delete
+from app import db
+from models import Question
+
+# Question editing as a diff: the quiz's current questions are loaded in one
+# query, compared with the submitted form, and only the differences are
+# written, each kind as a single bulk statement.
+
+# Form field name -> Question column
+FORM_FIELDS = {
+    'text': 'question_text',
+    'option_a': 'option_a',
+    'option_b': 'option_b',
+    'option_c': 'option_c',
+    'option_d': 'option_d',
+    'correct': 'correct_answer',
+}
+
+
+def parse_question_form(form):
+    """Group `questions[<idx>][<field>]` form keys into {idx: {field: value}}."""
+    questions_data = {}
+    for key, value in form.items():
+        if key.startswith('questions['):
+            parts = key.replace('questions[', '').replace(']', ' ').split()
+            idx, field = parts[0], parts[1].replace('[', '').replace(']', '')
+
+            if idx not in questions_data:
+                questions_data[idx] = {}
+            questions_data[idx][field] = value
+    # Entries without text are incomplete and skipped
+    return [q_data for q_data in questions_data.values() if 'text' in q_data]
+
+
+def _values(q_data):
+    return {column: q_data[field] for field, column in FORM_FIELDS.items()}
+
+
+def diff_questions(existing, submitted):
+    """Compare {id: values} for the stored questions with parsed form entries.
+
+    Returns (inserts, updates, delete_ids). Entries whose id does not belong
+    to this quiz are treated as new questions.
+    """
+    inserts = []
+    updates = []
+    kept = set()
+    for q_data in submitted:
+        values = _values(q_data)
+        question_id = int(q_data['id']) if q_data.get('id', '').isdigit() else None
+        if question_id in existing and question_id not in kept:
+            kept.add(question_id)
+            if values != existing[question_id]:
+                updates.append(dict(values, id=question_id))
+        else:
+            inserts.append(values)
+    delete_ids = [question_id for question_id in existing if question_id not in kept]
+    return inserts, updates, delete_ids
+
+
+def apply_question_form(quiz_id, form):
+    columns = [getattr(Question, column) for column in FORM_FIELDS.values()]
+    existing = {
+        row[0]: dict(zip(FORM_FIELDS.values(), row[1:]))
+        for row in db.session.query(Question.id, *columns).filter(Question.quiz_id == quiz_id)
+    }
+    inserts, updates, delete_ids = diff_questions(existing, parse_question_form(form))
+
+    if delete_ids:
+        db.session.execute(delete(Question).where(Question.id.in_(delete_ids))
+                           .execution_options(synchronize_session=False))
+    if updates:
+        db.session.execute(update(Question), updates)
+    if inserts:
+        db.session.execute(insert(Question), [dict(values, quiz_id=quiz_id) for values in inserts])
+    return len(inserts), len(updates), len(delete_ids)
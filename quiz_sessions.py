@@ -0,0 +1,325 @@
+import fcntl
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import current_app
+from app import db
+import content
+import grading
+import ingest
+
+# Quizzes in progress, kept off the database. take_quiz records when the
+# student started, the quiz page autosaves their answers, and submit_quiz
+# checks the deadline against the recorded start rather than trusting the
+# browser's timer. An attempt is only written on submit, or by the sweep once
+# a session is past its deadline without having been submitted. Autosave
+# requests sweep a few sessions at a time (see maybe_sweep());
+# `flask expire-quiz-sessions` sweeps them all, and run from cron with
+# QUIZ_SESSION_SWEEP_LIMIT = 0 keeps sweeping off requests altogether.
+#
+# Sessions live in a directory shared by every worker on the host (under
+# /dev/shm when it exists, so it is memory-backed), or with
+# QUIZ_SESSION_STORE = "memory" in this process only, which is enough for a
+# single worker. The quiz page coalesces answer changes and sends them at
+# most every QUIZ_AUTOSAVE_INTERVAL seconds, so a session costs one small
+# store write per interval however many questions are answered.
+#
+# For a quiz that draws a sample of its questions, the session also holds the
+# ids drawn when it started; reopening the quiz shows the same questions, and
+# only those are graded. question_ids is None when the attempt has them all.
+#
+# Submitting or expiring a session takes it out of the store before its
+# attempt is written, so concurrent submits record it once. If the write
+# fails, the session is put back (see restore()), so the student can submit
+# again, or the sweep can retry.
+
+QuizSession = namedtuple('QuizSession', 'user_id quiz_id started_at deadline answers question_ids',
+                         defaults=(None,))
+
+ANSWERS = ('A', 'B', 'C', 'D')
+LOCK_STRIPES = 64
+
+
+def _encode(session):
+    return json.dumps(session._replace(started_at=session.started_at.isoformat(),
+                                       deadline=session.deadline.isoformat())._asdict())
+
+
+def _decode(text):
+    fields = json.loads(text)
+    fields['started_at'] = datetime.fromisoformat(fields['started_at'])
+    fields['deadline'] = datetime.fromisoformat(fields['deadline'])
+    return QuizSession(**fields)
+
+
+class MemoryStore:
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def update(self, user_id, quiz_id, change):
+        # change(current session or None) returns the session to store
+        with self.lock:
+            current = self.sessions.get((user_id, quiz_id))
+            session = change(current)
+            if session is not current:
+                self.sessions[(user_id, quiz_id)] = session
+            return session
+
+    def take(self, user_id, quiz_id, condition=None):
+        with self.lock:
+            session = self.sessions.get((user_id, quiz_id))
+            if session is None or (condition and not condition(session)):
+                return None
+            return self.sessions.pop((user_id, quiz_id))
+
+    def all(self):
+        return list(self.sessions.values())
+
+
+class DirectoryStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, 'locks'), exist_ok=True)
+
+    def _path(self, user_id, quiz_id):
+        return os.path.join(self.directory, f'{user_id}-{quiz_id}.json')
+
+    @contextmanager
+    def _locked(self, user_id, quiz_id):
+        # A fixed set of lock files, so none are left behind per session
+        stripe = zlib.crc32(f'{user_id}-{quiz_id}'.encode()) % LOCK_STRIPES
+        with open(os.path.join(self.directory, 'locks', str(stripe)), 'a') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            yield
+
+    def _read(self, path):
+        try:
+            with open(path) as handle:
+                return _decode(handle.read())
+        except FileNotFoundError:
+            return None
+
+    def update(self, user_id, quiz_id, change):
+        path = self._path(user_id, quiz_id)
+        with self._locked(user_id, quiz_id):
+            current = self._read(path)
+            session = change(current)
+            if session is not current:
+                # Written aside and renamed over, so readers never see half a file
+                temporary = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+                with open(temporary, 'w') as handle:
+                    handle.write(_encode(session))
+                os.replace(temporary, path)
+            return session
+
+    def take(self, user_id, quiz_id, condition=None):
+        path = self._path(user_id, quiz_id)
+        with self._locked(user_id, quiz_id):
+            session = self._read(path)
+            if session is None or (condition and not condition(session)):
+                return None
+            os.unlink(path)
+            return session
+
+    def all(self):
+        # Read one at a time, so a sweep that stops early reads no further
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            session = self._read(path)
+            if session is not None:
+                yield session
+
+
+def _default_directory():
+    # One directory per database, so apps on the same host never share sessions
+    database = zlib.crc32(current_app.config['SQLALCHEMY_DATABASE_URI'].encode())
+    parent = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(parent, f'quizmaster-sessions-{database:08x}')
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if current_app.config['QUIZ_SESSION_STORE'] == 'memory':
+                    _store = MemoryStore()
+                else:
+                    _store = DirectoryStore(current_app.config.get('QUIZ_SESSION_DIR') or _default_directory())
+    return _store
+
+
+def cutoff(session):
+    # Submissions and autosaves are accepted for a short grace period after
+    # the deadline, to allow for the timer's own submit being in flight
+    return session.deadline + timedelta(seconds=current_app.config['QUIZ_SUBMIT_GRACE'])
+
+
+def remaining_seconds(session, now):
+    return max(0, int((session.deadline - now).total_seconds()))
+
+
+def begin(user_id, quiz_id, duration, now, draw=None):
+    """Start the quiz, or resume the session already in progress.
+
+    draw() picks the question ids of a new session (see
+    grading.sample_questions). Callers record a session that ran out first,
+    with take_expired() and record_expired(). A session still in the store
+    past its deadline is resumed, so it can only be submitted late.
+    """
+    def change(current):
+        if current is not None:
+            return current
+        return QuizSession(user_id, quiz_id, now, now + timedelta(minutes=duration), {},
+                           draw() if draw else None)
+
+    return get_store().update(user_id, quiz_id, change)
+
+
+def take_expired(user_id, quiz_id, now):
+    """Remove the session if it ran out without being submitted; returns it
+    (for record_expired()) or None."""
+    return get_store().take(user_id, quiz_id, lambda current: now > cutoff(current))
+
+
+def restore(session):
+    # Puts back a session whose attempt could not be written, unless the
+    # student has started the quiz again since
+    get_store().update(session.user_id, session.quiz_id,
+                       lambda current: session if current is None else current)
+
+
+def saved_answers(key, form):
+    # Only fields of this quiz with a valid option are kept
+    fields = set(key.fields)
+    return {field: value for field, value in form.items() if field in fields and value in ANSWERS}
+
+
+def autosave(user_id, quiz_id, answers, now):
+    """Merge `answers` into the session; returns None if it is not in progress."""
+    def change(current):
+        if current is None or now > cutoff(current) or not answers:
+            return current
+        return current._replace(answers={**current.answers, **answers})
+
+    session = get_store().update(user_id, quiz_id, change)
+    if session is None or now > cutoff(session):
+        return None
+    return session
+
+
+def finish(user_id, quiz_id, now):
+    """Remove the session for submission; returns (session, on_time).
+
+    session is None when the student has no quiz in progress. Pass it to
+    record(), which puts it back if the attempt cannot be written.
+    """
+    session = get_store().take(user_id, quiz_id)
+    return session, session is not None and now <= cutoff(session)
+
+
+def record(session, on_time, form=None, now=None, quiz=None, key=None):
+    """Grade a finished session and hand its attempt to the ingestion pipeline.
+
+    On time, the submitted `form` counts on top of the autosaved answers and
+    the attempt completes `now`; late, only what was autosaved counts and it
+    completes at the deadline. quiz (a content.QuizNode) and key (its full
+    answer key) are loaded when not given. Returns (score, question_count),
+    or None if the quiz has been deleted.
+    """
+    if quiz is None:
+        tree = content.catalog()
+        quiz = tree.quizzes.get(session.quiz_id)
+        if quiz is None:
+            return None
+        key = grading.answer_key(quiz.id, tree.version)
+    key = grading.subset(key, session.question_ids)
+    if on_time:
+        answers, completed_at = {**session.answers, **(form or {})}, now
+    else:
+        answers, completed_at = session.answers, session.deadline
+    score = grading.grade(key, answers)
+    try:
+        ingest.submit(ingest.PendingAttempt(
+            user_id=session.user_id,
+            quiz_id=quiz.id,
+            chapter_id=quiz.chapter_id,
+            score=score,
+            question_count=len(key.answers),
+            completed_at=completed_at,
+            question_ids=session.question_ids
+        ))
+    except Exception:
+        restore(session)
+        raise
+    return score, len(key.answers)
+
+
+def record_expired(session):
+    # Sessions that were opened but never answered are dropped
+    if session.answers:
+        record(session, on_time=False)
+
+
+def result_message(score, question_count, on_time):
+    if on_time:
+        return f'Quiz submitted! Your score: {score}/{question_count}'
+    return (f'Time was up, so only the answers saved before the deadline were counted. '
+            f'Your score: {score}/{question_count}')
+
+
+def sweep(now, limit=None):
+    """Record the sessions past their deadline, at most `limit` of them;
+    returns how many were expired."""
+    store = get_store()
+    expired = 0
+    for session in store.all():
+        if limit is not None and expired >= limit:
+            break
+        if now <= cutoff(session):
+            continue
+        # Re-checked under the lock: the student may have restarted the quiz
+        session = store.take(session.user_id, session.quiz_id, lambda current: now > cutoff(current))
+        if session is None:
+            continue
+        try:
+            record_expired(session)
+        except Exception:
+            # Back in the store for the next sweep
+            db.session.rollback()
+            current_app.logger.exception('Recording the expired quiz session of user %d at quiz %d failed',
+                                         session.user_id, session.quiz_id)
+            continue
+        expired += 1
+    return expired
+
+
+_last_sweep = 0.0
+
+
+def maybe_sweep():
+    # At most one sweep per QUIZ_SESSION_SWEEP_INTERVAL in each worker, of
+    # at most QUIZ_SESSION_SWEEP_LIMIT sessions, so the request that runs it
+    # pays for a few at most; when the limit is reached, the next request
+    # carries on. take() makes sure concurrent sweeps never record a session
+    # twice
+    global _last_sweep
+    limit = current_app.config['QUIZ_SESSION_SWEEP_LIMIT']
+    if not limit or time.monotonic() - _last_sweep < current_app.config['QUIZ_SESSION_SWEEP_INTERVAL']:
+        return 0
+    _last_sweep = time.monotonic()
+    expired = sweep(datetime.utcnow(), limit)
+    if expired >= limit:
+        _last_sweep = 0.0
+    return expired
@@ -0,0 +1,319 @@
+from collections import defaultdict
+from sqlalchemy import select, delete, insert, func, case
+from app import db
+from models import (Subject, Chapter, Quiz, Question, QuizAttempt, SubjectStats, QuizStats, DailyQuizStats,
+                    UserSubjectStats, UserMonthlyStats)
+import timeseries
+import grading
+import upserts
+
+# Counters are adjusted in place (x = x + delta) inside the caller's
+# transaction, so concurrent workers never overwrite each other; a missing
+# row is created by the same upsert, so they never collide creating it.
+# `flask rebuild-stats` and `flask rebuild-user-stats` recompute everything
+# from the base tables. A quiz's question_count is the number of questions it
+# now puts in each attempt, which is less than it has for quizzes drawing a
+# sample. Percentages are of each attempt's own question_count, so editing a
+# quiz leaves the scores of its earlier attempts as they were.
+
+SUBJECT_FIELDS = ('quiz_count', 'question_count', 'attempt_count', 'score_sum',
+                  'graded_attempt_count', 'percent_sum')
+
+
+def _bump(model, key, defaults=None, **deltas):
+    # Creates the row (with `defaults`) if it is not there yet
+    columns = [pk.key for pk in model.__mapper__.primary_key]
+    key = dict(zip(columns, key if isinstance(key, tuple) else (key,)))
+    stmt = upserts.insert(model).values(**key, **(defaults or {}), **deltas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=columns,
+        set_={name: getattr(model, name) + stmt.excluded[name] for name in deltas}
+    )
+    db.session.execute(stmt)
+
+
+def _contribution(question_count, attempt_count, score_sum):
+    # Share of a quiz in its subject's average percentage; quizzes without
+    # questions are left out, as the dashboard's inner join always did
+    if not question_count:
+        return 0.0, 0
+    return 100.0 * score_sum / question_count, attempt_count
+
+
+def _locked_quiz_stats(quiz_id):
+    return db.session.query(QuizStats).filter_by(quiz_id=quiz_id).with_for_update().first()
+
+
+def _subject_id(quiz):
+    return db.session.get(Chapter, quiz.chapter_id).subject_id
+
+
+def _question_count(quiz):
+    return grading.questions_per_attempt(Question.query.filter_by(quiz_id=quiz.id).count(), quiz.sample_size)
+
+
+def quiz_added(quiz):
+    question_count = _question_count(quiz)
+    subject_id = _subject_id(quiz)
+    db.session.add(QuizStats(quiz_id=quiz.id, subject_id=subject_id,
+                             question_count=question_count, attempt_count=0, score_sum=0))
+    _bump(SubjectStats, subject_id, quiz_count=1, question_count=question_count)
+    _bump(DailyQuizStats, quiz.start_date.date(), quiz_count=1)
+
+
+def quiz_updated(quiz, old_start_date):
+    row = _locked_quiz_stats(quiz.id)
+    if row is None:
+        quiz_added(quiz)
+        return
+    new_count = _question_count(quiz)
+    _bump(SubjectStats, row.subject_id, question_count=new_count - row.question_count)
+    row.question_count = new_count
+    if old_start_date.date() != quiz.start_date.date():
+        _bump(DailyQuizStats, old_start_date.date(), quiz_count=-1)
+        _bump(DailyQuizStats, quiz.start_date.date(), quiz_count=1)
+
+
+def _forget_user_attempts(*criteria):
+    # Take the attempts that are about to be cascade-deleted back out of the
+    # per-user tables; admin deletes are rare, so a pass over them is fine
+    by_subject = defaultdict(int)
+    by_month = defaultdict(int)
+    attempts = db.session.query(QuizAttempt.user_id, QuizAttempt.completed_at, Chapter.subject_id)\
+        .join(Quiz, QuizAttempt.quiz_id == Quiz.id)\
+        .join(Chapter, Quiz.chapter_id == Chapter.id)\
+        .filter(*criteria)\
+        .yield_per(1000)
+    for user_id, completed_at, subject_id in attempts:
+        by_subject[user_id, subject_id] += 1
+        by_month[user_id, timeseries.truncate(completed_at, 'month')] += 1
+    for key, count in by_subject.items():
+        _bump(UserSubjectStats, key, attempt_count=-count)
+    for key, count in by_month.items():
+        _bump(UserMonthlyStats, key, attempt_count=-count)
+
+
+def quiz_deleted(quiz):
+    _forget_user_attempts(Quiz.id == quiz.id)
+    row = _locked_quiz_stats(quiz.id)
+    _bump(DailyQuizStats, quiz.start_date.date(), quiz_count=-1)
+    if row is None:
+        return
+    _bump(SubjectStats, row.subject_id,
+          quiz_count=-1,
+          question_count=-row.question_count,
+          attempt_count=-row.attempt_count,
+          score_sum=-row.score_sum,
+          graded_attempt_count=-row.graded_attempt_count,
+          percent_sum=-row.percent_sum)
+    db.session.delete(row)
+
+
+def chapter_deleted(chapter):
+    for quiz in chapter.quizzes:
+        quiz_deleted(quiz)
+
+
+def subject_deleted(subject):
+    _forget_user_attempts(Chapter.subject_id == subject.id)
+    db.session.execute(delete(UserSubjectStats).where(UserSubjectStats.subject_id == subject.id))
+    for chapter in subject.chapters:
+        for quiz in chapter.quizzes:
+            _bump(DailyQuizStats, quiz.start_date.date(), quiz_count=-1)
+    db.session.execute(delete(QuizStats).where(QuizStats.subject_id == subject.id))
+    db.session.execute(delete(SubjectStats).where(SubjectStats.subject_id == subject.id))
+
+
+def quiz_subjects(quiz_ids):
+    # {quiz id: subject id} for the quizzes in quiz_ids that still exist
+    return dict(db.session.execute(
+        select(Quiz.id, Chapter.subject_id)
+        .join(Chapter, Quiz.chapter_id == Chapter.id)
+        .where(Quiz.id.in_(quiz_ids))
+    ).all())
+
+
+def record_attempts(attempts, subjects):
+    # Fold a batch of new attempts into the rollups with one UPDATE per
+    # touched row, however many attempts the batch holds. Each attempt
+    # carries user_id, quiz_id, chapter_id, score, question_count and
+    # completed_at; subjects is quiz_subjects() for their quizzes.
+    quizzes = defaultdict(lambda: [0, 0, 0, 0.0])
+    quiz_defaults = {}
+    subject_deltas = defaultdict(lambda: [0, 0, 0, 0.0])
+    user_subjects = defaultdict(int)
+    user_months = defaultdict(int)
+    for attempt in attempts:
+        subject_id = subjects.get(attempt.quiz_id)
+        if subject_id is None:
+            # Deleted, with its rollups, while the attempt was queued
+            continue
+        percent, graded = _contribution(attempt.question_count, 1, attempt.score)
+        quiz_totals = quizzes[attempt.quiz_id]
+        quiz_totals[0] += 1
+        quiz_totals[1] += attempt.score
+        quiz_totals[2] += graded
+        quiz_totals[3] += percent
+        quiz_defaults[attempt.quiz_id] = {'subject_id': subject_id, 'question_count': attempt.question_count}
+        subject_totals = subject_deltas[subject_id]
+        subject_totals[0] += 1
+        subject_totals[1] += attempt.score
+        subject_totals[2] += graded
+        subject_totals[3] += percent
+        user_subjects[attempt.user_id, subject_id] += 1
+        user_months[attempt.user_id, timeseries.truncate(attempt.completed_at, 'month')] += 1
+
+    # Rows are updated table by table, each in key order, so two batches
+    # touching the same rows lock them in the same order and never deadlock
+    for quiz_id, (attempt_count, score_sum, graded, percent) in sorted(quizzes.items()):
+        _bump(QuizStats, quiz_id, defaults=quiz_defaults[quiz_id],
+              attempt_count=attempt_count, score_sum=score_sum,
+              graded_attempt_count=graded, percent_sum=percent)
+    for subject_id, (attempt_count, score_sum, graded, percent) in sorted(subject_deltas.items()):
+        _bump(SubjectStats, subject_id,
+              attempt_count=attempt_count, score_sum=score_sum,
+              graded_attempt_count=graded, percent_sum=percent)
+    for key, count in sorted(user_subjects.items()):
+        _bump(UserSubjectStats, key, attempt_count=count)
+    for key, count in sorted(user_months.items()):
+        _bump(UserMonthlyStats, key, attempt_count=count)
+
+
+def subject_totals():
+    # Merged by subject name, matching the GROUP BY Subject.name the
+    # dashboard charts were originally built from
+    totals = defaultdict(lambda: dict.fromkeys(SUBJECT_FIELDS, 0))
+    rows = db.session.query(Subject.name, SubjectStats)\
+        .join(SubjectStats, SubjectStats.subject_id == Subject.id).all()
+    for name, row in rows:
+        for field in SUBJECT_FIELDS:
+            totals[name][field] += getattr(row, field)
+    return totals
+
+
+def user_subject_attempts_statement(user_id):
+    return select(Subject.name, func.sum(UserSubjectStats.attempt_count))\
+        .join(UserSubjectStats, UserSubjectStats.subject_id == Subject.id)\
+        .where(UserSubjectStats.user_id == user_id, UserSubjectStats.attempt_count > 0)\
+        .group_by(Subject.name)\
+        .order_by(Subject.name)
+
+
+def user_monthly_attempts_statement(user_id):
+    return select(UserMonthlyStats.month, UserMonthlyStats.attempt_count)\
+        .where(UserMonthlyStats.user_id == user_id, UserMonthlyStats.attempt_count > 0)\
+        .order_by(UserMonthlyStats.month)
+
+
+def user_subject_attempts(user_id):
+    return db.session.execute(user_subject_attempts_statement(user_id)).all()
+
+
+def user_monthly_attempts(user_id):
+    return db.session.execute(user_monthly_attempts_statement(user_id)).all()
+
+
+def active_quiz_count(now):
+    row = db.session.get(DailyQuizStats, now.date())
+    return row.quiz_count if row else 0
+
+
+def rebuild():
+    db.session.execute(delete(QuizStats))
+    db.session.execute(delete(SubjectStats))
+    db.session.execute(delete(DailyQuizStats))
+
+    question_counts = db.session.query(
+        Question.quiz_id.label('quiz_id'),
+        func.count(Question.id).label('question_count')
+    ).group_by(Question.quiz_id).subquery()
+
+    graded = QuizAttempt.question_count > 0
+    attempt_totals = db.session.query(
+        QuizAttempt.quiz_id.label('quiz_id'),
+        func.count(QuizAttempt.id).label('attempt_count'),
+        func.sum(QuizAttempt.score).label('score_sum'),
+        func.sum(case((graded, 1), else_=0)).label('graded_attempt_count'),
+        func.sum(case((graded, 100.0 * QuizAttempt.score / QuizAttempt.question_count), else_=0.0))
+        .label('percent_sum')
+    ).group_by(QuizAttempt.quiz_id).subquery()
+
+    quizzes = db.session.query(
+        Quiz.id,
+        Quiz.start_date,
+        Chapter.subject_id,
+        func.coalesce(question_counts.c.question_count, 0),
+        Quiz.sample_size,
+        func.coalesce(attempt_totals.c.attempt_count, 0),
+        func.coalesce(attempt_totals.c.score_sum, 0),
+        func.coalesce(attempt_totals.c.graded_attempt_count, 0),
+        func.coalesce(attempt_totals.c.percent_sum, 0.0)
+    ).join(Chapter, Quiz.chapter_id == Chapter.id)\
+    .outerjoin(question_counts, question_counts.c.quiz_id == Quiz.id)\
+    .outerjoin(attempt_totals, attempt_totals.c.quiz_id == Quiz.id)\
+    .all()
+
+    quiz_rows = []
+    subjects = defaultdict(lambda: dict.fromkeys(SUBJECT_FIELDS, 0))
+    days = defaultdict(int)
+    for (quiz_id, start_date, subject_id, question_count, sample_size, attempt_count, score_sum,
+         graded, percent) in quizzes:
+        question_count = grading.questions_per_attempt(question_count, sample_size)
+        quiz_rows.append({
+            'quiz_id': quiz_id,
+            'subject_id': subject_id,
+            'question_count': question_count,
+            'attempt_count': attempt_count,
+            'score_sum': score_sum,
+            'graded_attempt_count': graded,
+            'percent_sum': percent
+        })
+        totals = subjects[subject_id]
+        totals['quiz_count'] += 1
+        totals['question_count'] += question_count
+        totals['attempt_count'] += attempt_count
+        totals['score_sum'] += score_sum
+        totals['graded_attempt_count'] += graded
+        totals['percent_sum'] += percent
+        days[start_date.date()] += 1
+
+    if quiz_rows:
+        db.session.execute(insert(QuizStats), quiz_rows)
+    if subjects:
+        db.session.execute(insert(SubjectStats),
+                           [dict(subject_id=subject_id, **totals) for subject_id, totals in subjects.items()])
+    if days:
+        db.session.execute(insert(DailyQuizStats),
+                           [{'day': day, 'quiz_count': count} for day, count in days.items()])
+    return len(quiz_rows), len(subjects)
+
+
+def rebuild_user_stats():
+    db.session.execute(delete(UserSubjectStats))
+    db.session.execute(delete(UserMonthlyStats))
+
+    subject_rows = db.session.query(
+        QuizAttempt.user_id,
+        Chapter.subject_id,
+        func.count(QuizAttempt.id)
+    ).join(Quiz, QuizAttempt.quiz_id == Quiz.id)\
+    .join(Chapter, Quiz.chapter_id == Chapter.id)\
+    .group_by(QuizAttempt.user_id, Chapter.subject_id)\
+    .all()
+
+    # Month bucketing is dialect specific in SQL, so it is done while streaming
+    months = defaultdict(int)
+    for user_id, completed_at in db.session.query(QuizAttempt.user_id, QuizAttempt.completed_at).yield_per(10000):
+        months[user_id, timeseries.truncate(completed_at, 'month')] += 1
+
+    if subject_rows:
+        db.session.execute(insert(UserSubjectStats), [
+            {'user_id': user_id, 'subject_id': subject_id, 'attempt_count': count}
+            for user_id, subject_id, count in subject_rows
+        ])
+    if months:
+        db.session.execute(insert(UserMonthlyStats), [
+            {'user_id': user_id, 'month': month, 'attempt_count': count}
+            for (user_id, month), count in months.items()
+        ])
+    return len(subject_rows), len(months)
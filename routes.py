@@ -1,10 +1,22 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, session
+from flask import Blueprint, render_template, redirect, url_for, flash, request, session, abort, Response, stream_with_context, jsonify, current_app, make_response
 from flask_login import login_user, logout_user, login_required, current_user
 from app import db
 from models import User, Subject, Chapter, Quiz, Question, QuizAttempt
 from datetime import datetime, timedelta
-from sqlalchemy import func, case, text
-from sqlalchemy.types import Float
+from sqlalchemy import select
+import rollups
+import content
+import grading
+import pagination
+import export
+import question_import
+import quiz_editor
+import quiz_sessions
+import instrumentation
+import timeseries
+import leaderboards
+import passwords
+import fragments
 
 auth_bp = Blueprint('auth', __name__)
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -27,7 +39,16 @@ def login():
         password = request.form.get('password')
         user = User.query.filter_by(username=username).first()
 
-        if user and user.check_password(password):
+        try:
+            valid = user is not None and user.check_password(password)
+            if valid and passwords.needs_rehash(user.password_hash):
+                user.set_password(password)
+                db.session.commit()
+        except passwords.HashingBusy:
+            flash('Too many people are logging in right now. Please try again in a moment.')
+            return render_template('auth/login.html'), 503
+
+        if valid:
             login_user(user)
             # Clear any existing flash messages
             session.pop('_flashes', None)
@@ -56,7 +77,11 @@ def register():
 
         # Create new user
         user = User(username=username, email=email)
-        user.set_password(password)
+        try:
+            user.set_password(password)
+        except passwords.HashingBusy:
+            flash('Too many people are registering right now. Please try again in a moment.')
+            return render_template('auth/register.html'), 503
 
         # Set first user as admin
         if User.query.count() == 0:
@@ -86,17 +111,17 @@ def logout():
 def dashboard():
     if not current_user.is_admin:
         return redirect(url_for('user.user_dashboard'))
-    subjects = Subject.query.all()
+    tree = content.catalog()
+    subject_totals = rollups.subject_totals()
+    completed_attempts = sum(t['attempt_count'] for t in subject_totals.values())
+    score_sum = sum(t['score_sum'] for t in subject_totals.values())
 
     # Get statistics for admin dashboard
     stats = {
         'total_users': User.query.filter_by(is_admin=False).count(),
-        'active_quizzes': Quiz.query.filter(
-            Quiz.start_date <= datetime.utcnow(),
-            Quiz.end_date >= datetime.utcnow()
-        ).count(),
-        'completed_attempts': QuizAttempt.query.count(),
-        'avg_score': db.session.query(func.avg(QuizAttempt.score)).scalar() or 0
+        'active_quizzes': rollups.active_quiz_count(datetime.utcnow()),
+        'completed_attempts': completed_attempts,
+        'avg_score': score_sum / completed_attempts if completed_attempts else 0
     }
 
     # Get top scores by subject for bar chart
@@ -109,56 +134,37 @@ def dashboard():
         '#dc3545'   # Danger red
     ]
 
-    total_questions = db.session.query(
-        Quiz.id.label('quiz_id'),
-        func.count(Question.id).label('question_count')
-    ).join(Question, Question.quiz_id == Quiz.id)\
-    .group_by(Quiz.id).subquery()
-
-    top_scores = db.session.query(
-        Subject.name.label('subject_name'),
-        func.avg(
-            (100.0 * QuizAttempt.score / total_questions.c.question_count).cast(Float)
-        ).label('avg_score')
-    ).select_from(Subject)\
-    .join(Chapter, Chapter.subject_id == Subject.id)\
-    .join(Quiz, Quiz.chapter_id == Chapter.id)\
-    .join(QuizAttempt)\
-    .join(total_questions, total_questions.c.quiz_id == Quiz.id)\
-    .group_by(Subject.name)\
-    .order_by(text('avg_score DESC'))\
-    .all()
+    top_scores = sorted(
+        ((name, t['percent_sum'] / t['graded_attempt_count'])
+         for name, t in subject_totals.items() if t['graded_attempt_count']),
+        key=lambda s: s[1], reverse=True
+    )
 
     bar_chart_data = {
-        'labels': [s.subject_name for s in top_scores],
-        'data': [round(float(s.avg_score), 2) if s.avg_score else 0 for s in top_scores]
+        'labels': [s[0] for s in top_scores],
+        'data': [round(float(s[1]), 2) if s[1] else 0 for s in top_scores]
     }
 
     # Get subject-wise attempt distribution for concentric donut chart
-    attempt_distribution = db.session.query(
-        Subject.name.label('subject_name'),
-        func.count(QuizAttempt.id).label('attempt_count')
-    ).select_from(Subject)\
-    .join(Chapter, Chapter.subject_id == Subject.id)\
-    .join(Quiz, Quiz.chapter_id == Chapter.id)\
-    .join(QuizAttempt)\
-    .group_by(Subject.name)\
-    .order_by(func.count(QuizAttempt.id).desc())\
-    .all()
+    attempt_distribution = sorted(
+        ((name, t['attempt_count']) for name, t in subject_totals.items() if t['attempt_count']),
+        key=lambda s: s[1], reverse=True
+    )
 
     donut_chart_data = {
         'datasets': [{
-            'data': [s.attempt_count for s in attempt_distribution],
+            'data': [s[1] for s in attempt_distribution],
             'backgroundColor': colors,
-            'labels': [s.subject_name for s in attempt_distribution]
+            'labels': [s[0] for s in attempt_distribution]
         }]
     }
 
-    return render_template('admin/dashboard.html', 
-                         subjects=subjects,
+    return fragments.conditional(request, make_response(render_template('admin/dashboard.html',
+                         subjects=tree.subjects,
+                         catalog_version=tree.version,
                          stats=stats,
                          bar_chart_data=bar_chart_data,
-                         donut_chart_data=donut_chart_data)
+                         donut_chart_data=donut_chart_data)))
 
 @admin_bp.route('/subject/add', methods=['POST'])
 @login_required
@@ -168,6 +174,7 @@ def add_subject():
     name = request.form.get('name')
     subject = Subject(name=name)
     db.session.add(subject)
+    content.bump_content_version()
     db.session.commit()
     return redirect(url_for('admin.dashboard'))
 
@@ -180,6 +187,7 @@ def add_chapter():
     subject_id = request.form.get('subject_id')
     chapter = Chapter(name=name, subject_id=subject_id)
     db.session.add(chapter)
+    content.bump_content_version()
     db.session.commit()
     return redirect(url_for('admin.dashboard'))
 
@@ -188,9 +196,20 @@ def add_chapter():
 def manage_quiz(chapter_id):
     if not current_user.is_admin:
         return redirect(url_for('user.user_dashboard'))
-    chapter = Chapter.query.get_or_404(chapter_id)
+    chapter = content.catalog().chapters.get(chapter_id)
+    if chapter is None:
+        abort(404)
     return render_template('admin/quiz_management.html', chapter=chapter)
 
+def _sample_size(form):
+    # Blank means every attempt gets all of the quiz's questions
+    value = (form.get('sample_size') or '').strip()
+    if not value:
+        return None
+    if int(value) < 1:
+        raise ValueError('Questions per attempt must be at least 1')
+    return int(value)
+
 @admin_bp.route('/quiz/add/<int:chapter_id>', methods=['POST'])
 @login_required
 def add_quiz(chapter_id):
@@ -203,6 +222,7 @@ def add_quiz(chapter_id):
             title = request.form.get('title')
             start_date = datetime.strptime(request.form.get('start_date'), '%Y-%m-%d')
             duration = int(request.form.get('duration'))
+            sample_size = _sample_size(request.form)
 
             # Set start time to beginning of day and end time to end of day
             start_date = start_date.replace(hour=0, minute=0, second=0)
@@ -213,37 +233,20 @@ def add_quiz(chapter_id):
                 title=title,
                 chapter_id=chapter_id,
                 duration=duration,
+                sample_size=sample_size,
                 start_date=start_date,
                 end_date=end_date
             )
             db.session.add(quiz)
             db.session.flush()  # Get quiz.id before committing
 
-            # Process questions
-            questions_data = {}
-            for key, value in request.form.items():
-                if key.startswith('questions['):
-                    parts = key.replace('questions[', '').replace(']', ' ').split()
-                    idx, field = parts[0], parts[1].replace('[', '').replace(']', '')
-
-                    if idx not in questions_data:
-                        questions_data[idx] = {}
-                    questions_data[idx][field] = value
-
-            # Create Question objects
-            for idx, q_data in questions_data.items():
-                if 'text' in q_data:  # Ensure we have complete question data
-                    question = Question(
-                        quiz_id=quiz.id,
-                        question_text=q_data['text'],
-                        option_a=q_data['option_a'],
-                        option_b=q_data['option_b'],
-                        option_c=q_data['option_c'],
-                        option_d=q_data['option_d'],
-                        correct_answer=q_data['correct']
-                    )
-                    db.session.add(question)
+            # Create questions
+            quiz_editor.apply_question_form(quiz.id, request.form)
 
+            db.session.flush()
+            rollups.quiz_added(quiz)
+            leaderboards.quiz_added(quiz)
+            content.bump_content_version()
             db.session.commit()
             flash('Quiz created successfully!')
 
@@ -261,6 +264,95 @@ def edit_quiz(quiz_id):
     quiz = Quiz.query.get_or_404(quiz_id)
     return render_template('admin/edit_quiz.html', quiz=quiz)
 
+# How far back the quiz results trend chart goes, per bucket size
+TREND_SPANS = {
+    'day': timedelta(days=30),
+    'week': timedelta(weeks=26),
+    'month': timedelta(days=730),
+}
+
+@admin_bp.route('/quiz/<int:quiz_id>/results')
+@login_required
+def quiz_results(quiz_id):
+    if not current_user.is_admin:
+        return redirect(url_for('user.user_dashboard'))
+    quiz = content.catalog().quizzes.get(quiz_id)
+    if quiz is None:
+        abort(404)
+
+    query = db.session.query(
+        QuizAttempt.id,
+        QuizAttempt.score,
+        QuizAttempt.question_count,
+        QuizAttempt.completed_at,
+        User.username
+    ).join(User, QuizAttempt.user_id == User.id)\
+    .filter(QuizAttempt.quiz_id == quiz_id)
+
+    try:
+        results, next_cursor = pagination.attempt_page(query, request.args.get('cursor'))
+    except ValueError:
+        abort(400)
+
+    # Attempts and average score over the quiz's window, up to now
+    unit = request.args.get('unit', 'day')
+    if unit not in timeseries.UNITS:
+        abort(400)
+    until = min(datetime.utcnow(), quiz.end_date) + timedelta(seconds=1)
+    since = max(quiz.start_date, until - TREND_SPANS[unit])
+    series = timeseries.attempt_series(unit, since, until, QuizAttempt.quiz_id == quiz_id)
+
+    return render_template('admin/quiz_results.html',
+                         quiz=quiz,
+                         results=results,
+                         next_cursor=next_cursor,
+                         unit=unit,
+                         trend_chart_data=timeseries.trend_chart_data(series, unit))
+
+def _export_response(fmt, filename, columns, rows):
+    if fmt not in export.FORMATS:
+        abort(404)
+    # Gzipped when the client accepts it with a quality above 0 ("gzip;q=0"
+    # refuses it)
+    gzip = request.accept_encodings['gzip'] > 0
+    response = Response(
+        stream_with_context(export.encode(fmt, columns, rows, gzip=gzip)),
+        mimetype=export.FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}.{fmt}'}
+    )
+    response.headers['Vary'] = 'Accept-Encoding'
+    if gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@admin_bp.route('/metrics')
+@login_required
+def metrics():
+    if not current_user.is_admin:
+        return redirect(url_for('user.user_dashboard'))
+    if not current_app.config['METRICS']:
+        abort(404)
+    return Response(instrumentation.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@admin_bp.route('/export/results.<fmt>')
+@login_required
+def export_results(fmt):
+    if not current_user.is_admin:
+        return redirect(url_for('user.user_dashboard'))
+    quiz_id = request.args.get('quiz_id', type=int)
+    filename = f'quiz-{quiz_id}-results' if quiz_id else 'results'
+    return _export_response(fmt, filename, export.RESULT_COLUMNS, export.result_rows(quiz_id))
+
+@admin_bp.route('/export/quiz/<int:quiz_id>/questions.<fmt>')
+@login_required
+def export_questions(quiz_id, fmt):
+    if not current_user.is_admin:
+        return redirect(url_for('user.user_dashboard'))
+    if quiz_id not in content.catalog().quizzes:
+        abort(404)
+    return _export_response(fmt, f'quiz-{quiz_id}-questions', export.QUESTION_COLUMNS,
+                            export.question_rows(quiz_id))
+
 @admin_bp.route('/quiz/update/<int:quiz_id>', methods=['POST'])
 @login_required
 def update_quiz(quiz_id):
@@ -270,55 +362,26 @@ def update_quiz(quiz_id):
     quiz = Quiz.query.get_or_404(quiz_id)
 
     try:
+        old_start_date = quiz.start_date
+
         # Update quiz details
         quiz.title = request.form.get('title')
         start_date = datetime.strptime(request.form.get('start_date'), '%Y-%m-%d')
         quiz.duration = int(request.form.get('duration'))
+        quiz.sample_size = _sample_size(request.form)
 
         # Set start time to beginning of day and end time to end of day
         quiz.start_date = start_date.replace(hour=0, minute=0, second=0)
         quiz.end_date = start_date.replace(hour=23, minute=59, second=59)
 
-        # Process questions
-        questions_data = {}
-        existing_question_ids = set()
-
-        # Collect form data
-        for key, value in request.form.items():
-            if key.startswith('questions['):
-                parts = key.replace('questions[', '').replace(']', ' ').split()
-                idx, field = parts[0], parts[1].replace('[', '').replace(']', '')
-
-                if idx not in questions_data:
-                    questions_data[idx] = {}
-                questions_data[idx][field] = value
-
-        # Update or create questions
-        for idx, q_data in questions_data.items():
-            if 'text' in q_data:
-                if 'id' in q_data:  # Existing question
-                    question = Question.query.get(int(q_data['id']))
-                    if question:
-                        question.question_text = q_data['text']
-                        question.option_a = q_data['option_a']
-                        question.option_b = q_data['option_b']
-                        question.option_c = q_data['option_c']
-                        question.option_d = q_data['option_d']
-                        question.correct_answer = q_data['correct']
-                        existing_question_ids.add(question.id)
-                else:  # New question
-                    question = Question(
-                        quiz_id=quiz.id,
-                        question_text=q_data['text'],
-                        option_a=q_data['option_a'],
-                        option_b=q_data['option_b'],
-                        option_c=q_data['option_c'],
-                        option_d=q_data['option_d'],
-                        correct_answer=q_data['correct']
-                    )
-                    db.session.add(question)
+        # Apply only the inserted, changed and removed questions
+        quiz_editor.apply_question_form(quiz.id, request.form)
 
+        db.session.flush()
+        rollups.quiz_updated(quiz, old_start_date)
+        content.bump_content_version()
         db.session.commit()
+        grading.invalidate(quiz.id)
         flash('Quiz updated successfully!')
 
     except Exception as e:
@@ -328,88 +391,206 @@ def update_quiz(quiz_id):
     return redirect(url_for('admin.manage_quiz', chapter_id=quiz.chapter_id))
 
 
-# User routes
-@user_bp.route('/dashboard')
+@admin_bp.route('/quiz/<int:quiz_id>/import', methods=['POST'])
 @login_required
-def user_dashboard():
-    subjects = Subject.query.all()
+def import_questions(quiz_id):
+    if not current_user.is_admin:
+        return redirect(url_for('user.user_dashboard'))
 
-    # Get user's recent attempts
-    attempts = QuizAttempt.query.filter_by(user_id=current_user.id)\
-        .order_by(QuizAttempt.completed_at.desc())\
-        .limit(5).all()
+    quiz = Quiz.query.get_or_404(quiz_id)
+    upload = request.files.get('file')
+    fmt = question_import.format_for(upload.filename) if upload else None
+    if fmt is None:
+        flash('Please upload a .csv, .json or .ndjson file')
+        return redirect(url_for('admin.edit_quiz', quiz_id=quiz_id))
 
-    # Get subject-wise quiz attempts (for bar chart)
-    subject_attempts = db.session.query(
-        Subject.name,
-        func.count(QuizAttempt.id).label('attempt_count')
-    ).select_from(Subject)\
-    .join(Chapter)\
-    .join(Quiz)\
-    .join(QuizAttempt)\
-    .filter(QuizAttempt.user_id == current_user.id)\
-    .group_by(Subject.name)\
-    .all()
+    try:
+        report = question_import.import_questions(quiz_id, question_import.text_stream(upload.stream), fmt)
+        rollups.quiz_updated(quiz, quiz.start_date)
+        content.bump_content_version()
+        db.session.commit()
+        grading.invalidate(quiz_id)
+        flash(f'Imported {report.imported} questions')
+        for number, error in report.errors[:10]:
+            flash(f'Row {number} skipped: {error}')
+        if len(report.errors) > 10:
+            flash(f'{len(report.errors) - 10} more rows were skipped')
 
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error importing questions: {str(e)}')
+
+    return redirect(url_for('admin.edit_quiz', quiz_id=quiz_id))
+
+
+# User routes
+def user_chart_data(subject_attempts, monthly_attempts):
     # Prepare data for bar chart
     bar_chart_data = {
         'labels': [s[0] for s in subject_attempts],
         'data': [s[1] for s in subject_attempts]
     }
 
-    # Get monthly quiz attempts (for pie chart)
-    if 'sqlite' in str(db.engine.url):
-        # SQLite date formatting
-        monthly_attempts = db.session.query(
-            func.strftime('%Y-%m', QuizAttempt.completed_at).label('month'),
-            func.count(QuizAttempt.id).label('attempt_count')
-        ).filter(
-            QuizAttempt.user_id == current_user.id
-        ).group_by('month').all()
-    else:
-        # PostgreSQL date formatting
-        monthly_attempts = db.session.query(
-            func.to_char(QuizAttempt.completed_at, 'YYYY-MM').label('month'),
-            func.count(QuizAttempt.id).label('attempt_count')
-        ).filter(
-            QuizAttempt.user_id == current_user.id
-        ).group_by('month').all()
-
     # Prepare data for pie chart
     pie_chart_data = {
-        'labels': [datetime.strptime(m[0], '%Y-%m').strftime('%b %Y') for m in monthly_attempts],
+        'labels': [timeseries.label(m[0], 'month') for m in monthly_attempts],
         'data': [m[1] for m in monthly_attempts]
     }
+    return bar_chart_data, pie_chart_data
+
+@user_bp.route('/dashboard')
+@login_required
+def user_dashboard():
+    tree = content.catalog()
+
+    # Get user's recent attempts
+    attempts = QuizAttempt.query.filter_by(user_id=current_user.id)\
+        .order_by(QuizAttempt.completed_at.desc())\
+        .limit(5).all()
 
-    return render_template('user/dashboard.html', 
-                         subjects=subjects, 
+    # Get subject-wise quiz attempts (for bar chart) and monthly quiz
+    # attempts (for pie chart)
+    bar_chart_data, pie_chart_data = user_chart_data(
+        rollups.user_subject_attempts(current_user.id),
+        rollups.user_monthly_attempts(current_user.id)
+    )
+
+    return fragments.conditional(request, make_response(render_template('user/dashboard.html',
+                         subjects=tree.subjects,
+                         catalog_version=tree.version,
+                         quizzes=tree.quizzes,
                          attempts=attempts,
                          bar_chart_data=bar_chart_data,
-                         pie_chart_data=pie_chart_data)
+                         pie_chart_data=pie_chart_data)))
+
+@user_bp.route('/attempts')
+@login_required
+def attempt_history():
+    query = QuizAttempt.query.filter_by(user_id=current_user.id)
+    try:
+        attempts, next_cursor = pagination.attempt_page(query, request.args.get('cursor'))
+    except ValueError:
+        abort(400)
+
+    return render_template('user/attempts.html',
+                         quizzes=content.catalog().quizzes,
+                         attempts=attempts,
+                         next_cursor=next_cursor)
+
+LEADERBOARD_SIZE = 10
+
+@user_bp.route('/leaderboard')
+@login_required
+def leaderboard():
+    tree = content.catalog()
+    quiz_id = request.args.get('quiz_id', type=int)
+    subject_id = request.args.get('subject_id', type=int)
+    if quiz_id is not None:
+        quiz = tree.quizzes.get(quiz_id)
+        if quiz is None:
+            abort(404)
+        subject_id = tree.chapters[quiz.chapter_id].subject_id
+    subject = next((s for s in tree.subjects if s.id == subject_id), None)
+    if subject_id is not None and subject is None:
+        abort(404)
+
+    if quiz_id is not None:
+        board, title = leaderboards.quiz_board(quiz_id), quiz.title
+    elif subject is not None:
+        board, title = leaderboards.subject_board(subject.id), subject.name
+    else:
+        board, title = leaderboards.GLOBAL, 'All Subjects'
+
+    rankings = leaderboards.top(board, LEADERBOARD_SIZE)
+    mine, entrants = leaderboards.rank(board, current_user.id)
+    usernames = dict(db.session.query(User.id, User.username)
+                     .filter(User.id.in_([r.user_id for r in rankings])))
+
+    return render_template('user/leaderboard.html',
+                         title=title,
+                         per_quiz=quiz_id is not None,
+                         subjects=tree.subjects,
+                         subject=subject,
+                         rankings=rankings,
+                         usernames=usernames,
+                         mine=mine,
+                         entrants=entrants)
+
+def questions_statement(quiz_id, question_ids):
+    # All of the quiz's questions, or only those drawn for the attempt
+    if question_ids is None:
+        return select(Question).where(Question.quiz_id == quiz_id).order_by(Question.id)
+    return select(Question).where(Question.id.in_(question_ids))
+
+def drawn_order(questions, question_ids):
+    # Questions drawn for an attempt are shown in the order they were drawn
+    if question_ids is None:
+        return questions
+    position = {question_id: i for i, question_id in enumerate(question_ids)}
+    return sorted(questions, key=lambda question: position[question.id])
+
+def quiz_questions(quiz_id, question_ids):
+    return drawn_order(db.session.execute(questions_statement(quiz_id, question_ids)).scalars().all(),
+                       question_ids)
 
 @user_bp.route('/quiz/<int:quiz_id>')
 @login_required
 def take_quiz(quiz_id):
-    quiz = Quiz.query.get_or_404(quiz_id)
-    if datetime.utcnow() < quiz.start_date or datetime.utcnow() > quiz.end_date:
+    tree = content.catalog()
+    quiz = tree.quizzes.get(quiz_id)
+    if quiz is None:
+        abort(404)
+    now = datetime.utcnow()
+    if now < quiz.start_date or now > quiz.end_date:
         flash('Quiz is not available at this time')
         return redirect(url_for('user.user_dashboard'))
-    return render_template('user/quiz.html', quiz=quiz)
+
+    expired = quiz_sessions.take_expired(current_user.id, quiz.id, now)
+    if expired is not None:
+        quiz_sessions.record_expired(expired)
+    # Reopening the quiz resumes the session in progress: timer, answers and
+    # the questions drawn for it. The key is only needed to draw them
+    draw = None
+    if quiz.sample_size is not None:
+        def draw():
+            return grading.sample_questions(grading.answer_key(quiz.id, tree.version), quiz.sample_size)
+    quiz_session = quiz_sessions.begin(current_user.id, quiz.id, quiz.duration, now, draw)
+    return render_template('user/quiz.html', quiz=quiz,
+                         questions=quiz_questions(quiz.id, quiz_session.question_ids),
+                         answers=quiz_session.answers,
+                         remaining=quiz_sessions.remaining_seconds(quiz_session, now),
+                         autosave_interval=current_app.config['QUIZ_AUTOSAVE_INTERVAL'])
+
+@user_bp.route('/quiz/<int:quiz_id>/autosave', methods=['POST'])
+@login_required
+def autosave_quiz(quiz_id):
+    tree = content.catalog()
+    if quiz_id not in tree.quizzes:
+        abort(404)
+    now = datetime.utcnow()
+    key = grading.answer_key(quiz_id, tree.version)
+    quiz_session = quiz_sessions.autosave(current_user.id, quiz_id,
+                                          quiz_sessions.saved_answers(key, request.form), now)
+    quiz_sessions.maybe_sweep()
+    if quiz_session is None:
+        return jsonify(error='This quiz is not in progress'), 409
+    return jsonify(saved=len(quiz_session.answers),
+                   remaining=quiz_sessions.remaining_seconds(quiz_session, now))
 
 @user_bp.route('/quiz/<int:quiz_id>/submit', methods=['POST'])
 @login_required
 def submit_quiz(quiz_id):
-    quiz = Quiz.query.get_or_404(quiz_id)
-    score = 0
-    for question in quiz.questions:
-        answer = request.form.get(f'question_{question.id}')
-        if answer == question.correct_answer:
-            score += 1
-
-    attempt = QuizAttempt(user_id=current_user.id, quiz_id=quiz_id, score=score)
-    db.session.add(attempt)
-    db.session.commit()
-    flash(f'Quiz submitted! Your score: {score}/{len(quiz.questions)}')
+    now = datetime.utcnow()
+    quiz_session, on_time = quiz_sessions.finish(current_user.id, quiz_id, now)
+    if quiz_session is None:
+        flash('This quiz is not in progress. Start it from your dashboard.')
+        return redirect(url_for('user.user_dashboard'))
+
+    # Past the deadline, only what was autosaved in time counts
+    result = quiz_sessions.record(quiz_session, on_time, request.form.to_dict(), now)
+    if result is None:
+        abort(404)
+    flash(quiz_sessions.result_message(*result, on_time))
     return redirect(url_for('user.user_dashboard'))
 
 @admin_bp.route('/subject/delete/<int:subject_id>', methods=['POST'])
@@ -420,7 +601,10 @@ def delete_subject(subject_id):
 
     try:
         subject = Subject.query.get_or_404(subject_id)
+        rollups.subject_deleted(subject)
+        leaderboards.subject_deleted(subject)
         db.session.delete(subject)
+        content.bump_content_version()
         db.session.commit()
         flash('Subject deleted successfully')
         return '', 200
@@ -437,7 +621,10 @@ def delete_chapter(chapter_id):
 
     try:
         chapter = Chapter.query.get_or_404(chapter_id)
+        rollups.chapter_deleted(chapter)
+        leaderboards.quizzes_deleted([quiz.id for quiz in chapter.quizzes])
         db.session.delete(chapter)
+        content.bump_content_version()
         db.session.commit()
         flash('Chapter deleted successfully')
         return '', 200
@@ -454,8 +641,12 @@ def delete_quiz(quiz_id):
 
     try:
         quiz = Quiz.query.get_or_404(quiz_id)
+        rollups.quiz_deleted(quiz)
+        leaderboards.quizzes_deleted([quiz.id])
         db.session.delete(quiz)
+        content.bump_content_version()
         db.session.commit()
+        grading.invalidate(quiz_id)
         flash('Quiz deleted successfully')
         return '', 200
     except Exception as e:
@@ -0,0 +1,112 @@
+import fcntl
+from flask import current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, Insert, Update, Delete, Select
+from sqlalchemy.pool import QueuePool
+
+# Production profile for a SQLite database shared by several workers
+# (SQLITE_TUNING = "1"). Every connection gets WAL journaling and the
+# SQLITE_* pragmas below. Writes go through one connection per worker (the
+# default engine, sized in app.py) whose transactions start with BEGIN
+# IMMEDIATE, after taking an exclusive lock on a file next to the database:
+# writers from every worker queue on that lock in the kernel instead of
+# failing with "database is locked" when a deferred transaction cannot
+# upgrade, or polling in SQLite's busy handler. Reads use a separate pool of
+# query-only connections, which under WAL never wait for the writer.
+#
+# RoutingSession picks the connection per statement. Reads go to the reader
+# pool until the session's transaction writes (a flush, an INSERT, UPDATE or
+# DELETE, SELECT ... FOR UPDATE or raw SQL); from then until commit or
+# rollback everything goes to the writer, so the transaction reads its own
+# changes.
+
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'SQLITE_SYNCHRONOUS'),
+    ('busy_timeout', 'SQLITE_BUSY_TIMEOUT'),
+    ('mmap_size', 'SQLITE_MMAP_SIZE'),
+    ('cache_size', 'SQLITE_CACHE_SIZE'),
+    ('temp_store', 'MEMORY'),
+)
+
+
+def _pragmas(dbapi_connection, config, query_only):
+    cursor = dbapi_connection.cursor()
+    for name, value in PRAGMAS:
+        cursor.execute(f'PRAGMA {name} = {config.get(value, value)}')
+    if query_only:
+        cursor.execute('PRAGMA query_only = ON')
+    cursor.close()
+
+
+def configure_reader(engine, config):
+    event.listen(engine, 'connect',
+                 lambda dbapi_connection, record: _pragmas(dbapi_connection, config, query_only=True))
+
+
+def configure_writer(engine, config):
+    lock_path = f'{engine.url.database}.write-lock'
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, record):
+        _pragmas(dbapi_connection, config, query_only=False)
+        # The driver must not open transactions itself; begin() does
+        dbapi_connection.isolation_level = None
+        record.info['write_lock'] = open(lock_path, 'a')
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        info = connection.connection.info
+        fcntl.flock(info['write_lock'], fcntl.LOCK_EX)
+        info['write_locked'] = True
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+    @event.listens_for(engine, 'checkin')
+    def checkin(dbapi_connection, record):
+        # After the transaction has been committed or rolled back
+        if record.info.pop('write_locked', False):
+            fcntl.flock(record.info['write_lock'], fcntl.LOCK_UN)
+
+    @event.listens_for(engine, 'close')
+    def close(dbapi_connection, record):
+        record.info.pop('write_lock').close()
+
+
+def init_app(app, db):
+    if not app.config['SQLITE_TUNING']:
+        return
+    with app.app_context():
+        writer = db.engine
+    if writer.dialect.name != 'sqlite' or writer.url.database in (None, '', ':memory:'):
+        return
+    configure_writer(writer, app.config)
+    reader = create_engine(writer.url, poolclass=QueuePool,
+                           pool_size=app.config['SQLITE_READERS'], max_overflow=0)
+    configure_reader(reader, app.config)
+    app.extensions['sqlite_reader'] = reader
+
+
+def _writes(clause):
+    if isinstance(clause, (Insert, Update, Delete)):
+        return True
+    if isinstance(clause, Select):
+        return clause._for_update_arg is not None
+    # Raw SQL and anything else unrecognised
+    return clause is not None
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        reader = current_app.extensions.get('sqlite_reader') if bind is None else None
+        if reader is None:
+            return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if self._flushing or self.info.get('writing') or _writes(clause):
+            self.info['writing'] = True
+            return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        return reader
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _transaction_ended(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('writing', None)
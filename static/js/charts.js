@@ -332,6 +332,51 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         });
     }
+
+    // Attempts and average score over time for a quiz
+    const trendChart = document.getElementById('trendChart');
+    if (trendChart && typeof trendChartData !== 'undefined') {
+        new Chart(trendChart, {
+            data: {
+                labels: trendChartData.labels,
+                datasets: [{
+                    type: 'bar',
+                    label: 'Attempts',
+                    data: trendChartData.attempts,
+                    backgroundColor: colors[0],
+                    yAxisID: 'attempts'
+                }, {
+                    type: 'line',
+                    label: 'Average Score (%)',
+                    data: trendChartData.scores,
+                    borderColor: colors[1],
+                    spanGaps: true,
+                    tension: 0.1,
+                    yAxisID: 'score'
+                }]
+            },
+            options: {
+                responsive: true,
+                scales: {
+                    attempts: {
+                        position: 'left',
+                        beginAtZero: true,
+                        ticks: {
+                            precision: 0
+                        }
+                    },
+                    score: {
+                        position: 'right',
+                        beginAtZero: true,
+                        max: 100,
+                        grid: {
+                            drawOnChartArea: false
+                        }
+                    }
+                }
+            }
+        });
+    }
 });
 
 // Function to update charts with new data
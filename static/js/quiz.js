@@ -28,3 +28,67 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 });
+
+// Answer changes are collected and sent together every `interval` ms, so
+// answering many questions quickly still costs one request per interval.
+// Anything not yet acknowledged is kept and retried on the next tick.
+function initializeAutosave(url, interval) {
+    const form = document.getElementById('quizForm');
+    const status = document.getElementById('autosaveStatus');
+    let pending = {};
+    let inFlight = false;
+    let stopped = false;
+
+    form.addEventListener('change', (e) => {
+        if (e.target.type === 'radio') {
+            pending[e.target.name] = e.target.value;
+        }
+    });
+
+    function body(answers) {
+        const data = new FormData();
+        Object.entries(answers).forEach(([name, value]) => data.append(name, value));
+        return data;
+    }
+
+    async function flush() {
+        if (stopped || inFlight || Object.keys(pending).length === 0) {
+            return;
+        }
+        const sending = pending;
+        pending = {};
+        inFlight = true;
+        try {
+            const response = await fetch(url, {method: 'POST', body: body(sending), credentials: 'same-origin'});
+            if (response.status === 409) {
+                stopped = true;
+                status.textContent = 'This quiz is no longer in progress; answers are not being saved.';
+            } else if (!response.ok || response.redirected) {
+                throw new Error(response.statusText);
+            } else {
+                status.textContent = `Answers saved at ${new Date().toLocaleTimeString()}`;
+            }
+        } catch (err) {
+            // Newer changes to the same question win over the unsent ones
+            pending = Object.assign(sending, pending);
+            status.textContent = 'Offline: answers will be saved when the connection is back.';
+        } finally {
+            inFlight = false;
+        }
+    }
+
+    setInterval(flush, interval);
+
+    // Last chance when the tab is hidden or closed
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'hidden' && Object.keys(pending).length > 0 && !stopped) {
+            if (navigator.sendBeacon(url, body(pending))) {
+                pending = {};
+            }
+        }
+    });
+
+    form.addEventListener('submit', () => {
+        stopped = true;
+    });
+}
@@ -0,0 +1,124 @@
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from sqlalchemy import select, func, cast, Date, type_coerce
+from app import db
+from models import QuizAttempt
+
+# Attempt counts and scores bucketed by day, week (starting Monday) or month.
+# Rows are selected with a plain range on completed_at, so the
+# (quiz_id, completed_at) and (user_id, completed_at) history indexes serve
+# per-quiz and per-user series as range scans; only the GROUP BY uses a
+# date-truncation expression, picked for the database's dialect once, by
+# init_app(). Buckets come back as date objects, and empty ones are filled
+# in, so charts get a continuous axis.
+
+UNITS = ('day', 'week', 'month')
+LABEL_FORMATS = {
+    'day': '%d %b',
+    'week': 'w/c %d %b',
+    'month': '%b %Y',
+}
+
+# question_sum: the questions in those attempts, which score_sum is out of
+Bucket = namedtuple('Bucket', 'start attempts score_sum question_sum')
+
+
+def truncate(moment, unit):
+    """The first day of the bucket `moment` falls in."""
+    day = moment.date() if isinstance(moment, datetime) else moment
+    if unit == 'day':
+        return day
+    if unit == 'week':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def next_bucket(start, unit):
+    if unit == 'day':
+        return start + timedelta(days=1)
+    if unit == 'week':
+        return start + timedelta(days=7)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def bucket_starts(since, until, unit):
+    """Every bucket overlapping [since, until)."""
+    starts = []
+    start = truncate(since, unit)
+    end = until if isinstance(until, datetime) else datetime.combine(until, time.min)
+    while datetime.combine(start, time.min) < end:
+        starts.append(start)
+        start = next_bucket(start, unit)
+    return starts
+
+
+def label(start, unit):
+    return start.strftime(LABEL_FORMATS[unit])
+
+
+def _sqlite_bucket(column, unit):
+    modifiers = {'day': (), 'week': ('weekday 0', '-6 days'), 'month': ('start of month',)}[unit]
+    return type_coerce(func.date(column, *modifiers), Date)
+
+
+def _postgresql_bucket(column, unit):
+    return cast(func.date_trunc(unit, column), Date)
+
+
+BUCKET_EXPRESSIONS = {
+    'sqlite': _sqlite_bucket,
+    'postgresql': _postgresql_bucket,
+}
+
+# Set by init_app(); None means bucketing in Python
+_bucket_expression = None
+
+
+def init_app(app):
+    global _bucket_expression
+    with app.app_context():
+        _bucket_expression = BUCKET_EXPRESSIONS.get(db.engine.dialect.name)
+
+
+def series_statement(unit, since, until, *criteria):
+    """(bucket, attempts, score sum, question sum) per bucket; only for
+    dialects with a bucket expression."""
+    bucket = _bucket_expression(QuizAttempt.completed_at, unit)
+    return select(bucket, func.count(QuizAttempt.id), func.sum(QuizAttempt.score),
+                  func.sum(QuizAttempt.question_count))\
+        .where(QuizAttempt.completed_at >= since, QuizAttempt.completed_at < until, *criteria)\
+        .group_by(bucket)
+
+
+def attempt_series(unit, since, until, *criteria):
+    """Attempts with completed_at in [since, until) matching `criteria`, as one
+    Bucket per `unit` from the bucket holding `since` onwards."""
+    if unit not in UNITS:
+        raise ValueError(f'unknown unit {unit!r}')
+    totals = {}
+    if _bucket_expression is not None:
+        statement = series_statement(unit, since, until, *criteria)
+        for start, attempts, score_sum, question_sum in db.session.execute(statement):
+            totals[start] = (attempts, score_sum or 0, question_sum or 0)
+    else:
+        rows = db.session.query(QuizAttempt.completed_at, QuizAttempt.score, QuizAttempt.question_count)\
+            .filter(QuizAttempt.completed_at >= since, QuizAttempt.completed_at < until, *criteria)
+        for completed_at, score, question_count in rows:
+            start = truncate(completed_at, unit)
+            attempts, score_sum, question_sum = totals.get(start, (0, 0, 0))
+            totals[start] = (attempts + 1, score_sum + score, question_sum + question_count)
+    return [Bucket(start, *totals.get(start, (0, 0, 0))) for start in bucket_starts(since, until, unit)]
+
+
+def trend_chart_data(series, unit):
+    # Attempts per bucket and the average score as a percentage, of the
+    # questions each attempt had; buckets without attempts have no score
+    # rather than 0%
+    return {
+        'labels': [label(bucket.start, unit) for bucket in series],
+        'attempts': [bucket.attempts for bucket in series],
+        'scores': [
+            round(bucket.score_sum * 100 / bucket.question_sum, 2) if bucket.question_sum else None
+            for bucket in series
+        ],
+    }
@@ -0,0 +1,14 @@
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+
+# INSERT ... ON CONFLICT, which SQLAlchemy spells per dialect. Counters and
+# leaderboard rows that two workers may create at once are written with it,
+# so neither fails on the other's row.
+
+DIALECTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def insert(model):
+    """An INSERT into `model` that takes on_conflict_do_update() and
+    on_conflict_do_nothing()."""
+    return DIALECTS[db.engine.dialect.name](model)
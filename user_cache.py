@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import event, select
+from app import db, login_manager
+from models import User
+
+# Flask-Login loads the user on every authenticated request. Requests only
+# need the id, username and admin flag, so each worker keeps those for up to
+# USER_CACHE_TTL seconds (0 turns the cache off) instead of reading the user
+# row every time. Updating or deleting a User through the ORM drops it from
+# this worker's cache straight away; other workers see the change once their
+# entry expires.
+
+
+class CachedUser(UserMixin):
+    def __init__(self, id, username, is_admin):
+        self.id = id
+        self.username = username
+        self.is_admin = is_admin
+
+
+MAX_CACHED_USERS = 10000
+
+_users = OrderedDict()
+_users_lock = threading.Lock()
+
+USER_QUERY = select(User.id, User.username, User.is_admin)
+
+
+def cached(user_id):
+    with _users_lock:
+        entry = _users.get(user_id)
+        if entry is None:
+            return None
+        expires, user = entry
+        if expires <= time.monotonic():
+            del _users[user_id]
+            return None
+        _users.move_to_end(user_id)
+        return user
+
+
+def remember(row, ttl):
+    user = CachedUser(row.id, row.username, bool(row.is_admin))
+    if ttl > 0:
+        with _users_lock:
+            _users[user.id] = (time.monotonic() + ttl, user)
+            _users.move_to_end(user.id)
+            while len(_users) > MAX_CACHED_USERS:
+                _users.popitem(last=False)
+    return user
+
+
+def forget(user_id):
+    with _users_lock:
+        _users.pop(user_id, None)
+
+
+@login_manager.user_loader
+def load_user(id):
+    user_id = int(id)
+    user = cached(user_id)
+    if user is None:
+        row = db.session.execute(USER_QUERY.where(User.id == user_id)).first()
+        user = remember(row, current_app.config['USER_CACHE_TTL']) if row is not None else None
+    return user
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    forget(target.id)
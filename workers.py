@@ -0,0 +1,30 @@
+import os
+import threading
+
+# Background threads and pools do not survive a fork: gunicorn builds the app
+# in the master (see gunicorn.conf.py) and forks the workers from it, so
+# anything that runs a thread is started lazily, in the worker that uses it.
+# per_process() wraps the function that starts it, so each forked worker gets
+# its own ingestion queue, profiler thread and password hashing pool.
+
+
+def per_process(factory, retire=None):
+    """Returns get(*args), which calls factory(*args) once in each process and
+    hands back what it returned, until it is called with different args. A
+    value replaced within the same process is then passed to retire()."""
+    lock = threading.Lock()
+    made = {'key': None, 'value': None}
+
+    def get(*args):
+        key = (os.getpid(), args)
+        if made['key'] != key:
+            with lock:
+                if made['key'] != key:
+                    previous = made['value'] if made['key'] and made['key'][0] == key[0] else None
+                    made['value'] = factory(*args)
+                    made['key'] = key
+                    if retire is not None and previous is not None:
+                        retire(previous)
+        return made['value']
+
+    return get